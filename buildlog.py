@@ -0,0 +1,141 @@
+try:
+    from .util import make_parent_dirs
+except(ValueError):
+    from util import make_parent_dirs
+
+import codecs
+import itertools
+import os
+import threading
+
+
+class BuildLog(object):
+
+    # The complete output of the window's sbt, written to sbt.log under the
+    # project's target directory so that it doesn't have to be kept in the
+    # output panel or in memory. Output is appended from the I/O thread
+    # through a buffered file. Each sbt session starts a new log, and a log
+    # that grows past max_bytes is rotated too, keeping `backups` old logs.
+    # Every check_interval writes, and on flush, the log is reopened if its
+    # path is gone, as it is after `sbt clean`. An I/O error turns the log
+    # off until the next session.
+
+    file_name = 'sbt.log'
+    max_bytes = 32 * 2 ** 20
+    backups = 3
+    buffer_size = 2 ** 16
+    check_interval = 64
+
+    def __init__(self, project):
+        self._project = project
+        self._path = None
+        self._file = None
+        self._size = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def path(self):
+        return self._project.data_path(type(self).file_name)
+
+    def start(self):
+        with self._lock:
+            self._close()
+            if self._project.setting('build_log'):
+                self._path = self.path()
+                self._rotate()
+
+    def write(self, output):
+        with self._lock:
+            if self._path is not None:
+                self._writes += 1
+                if self._writes % type(self).check_interval == 0:
+                    self._reopen_if_deleted()
+                if self._file is None:
+                    self._open()
+                if self._file is not None:
+                    data = output.encode('utf-8')
+                    try:
+                        self._file.write(data)
+                        self._size += len(data)
+                        if self._size > type(self).max_bytes:
+                            self._rotate()
+                    except (IOError, OSError):
+                        self._disable()
+
+    def close(self):
+        with self._lock:
+            self._close()
+            self._path = None
+
+    def flush(self):
+        with self._lock:
+            self._reopen_if_deleted()
+            if self._file is not None:
+                try:
+                    self._file.flush()
+                except (IOError, OSError):
+                    self._disable()
+
+    def exists(self):
+        path = self.path()
+        return path is not None and os.path.isfile(path)
+
+    def lines(self, first=1, last=None):
+        self.flush()
+        with open(self.path(), 'rb') as f:
+            for line in itertools.islice(f, first - 1, last):
+                yield line.decode('utf-8', 'replace')
+
+    def chunks(self, size=2 ** 15):
+        self.flush()
+        decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        with open(self.path(), 'rb') as f:
+            while True:
+                data = f.read(size)
+                yield decoder.decode(data, final=not data)
+                if not data:
+                    return
+
+    def _open(self):
+        try:
+            make_parent_dirs(self._path)
+            self._file = open(self._path, 'ab', type(self).buffer_size)
+            self._size = self._file.tell()
+        except (IOError, OSError):
+            self._disable()
+
+    def _close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            finally:
+                self._file = None
+
+    def _disable(self):
+        try:
+            self._close()
+        except (IOError, OSError):
+            pass
+        self._path = None
+
+    def _reopen_if_deleted(self):
+        # The next write opens a new file at the path.
+        if self._file is not None and not os.path.exists(self._path):
+            try:
+                self._close()
+            except (IOError, OSError):
+                pass
+
+    def _rotate(self):
+        try:
+            self._close()
+            oldest = '%s.%i' % (self._path, type(self).backups)
+            if os.path.isfile(oldest):
+                os.remove(oldest)
+            for n in range(type(self).backups - 1, 0, -1):
+                if os.path.isfile('%s.%i' % (self._path, n)):
+                    os.rename('%s.%i' % (self._path, n), '%s.%i' % (self._path, n + 1))
+            if os.path.isfile(self._path):
+                os.rename(self._path, self._path + '.1')
+        except (IOError, OSError):
+            self._disable()
@@ -1,9 +1,9 @@
 try:
     from .highlighter import CodeHighlighter
-    from .util import delayed, maybe
+    from .util import deferred, group_by, maybe
 except(ValueError):
     from highlighter import CodeHighlighter
-    from util import delayed, maybe
+    from util import deferred, group_by, maybe
 
 
 class ErrorMarker(object):
@@ -15,34 +15,43 @@ class ErrorMarker(object):
         self.__highlighter = None
         settings.add_on_change(self.mark_errors)
 
-    @delayed(0)
+    @deferred(key=lambda self: self)
     def mark_errors(self):
         for view in self._window.views():
             errors = self._error_report.sorted_errors_in(view.file_name())
             self._mark_errors_in_view(view, errors)
 
-    @delayed(0)
+    @deferred(key=lambda self, filename: (self, filename))
     def mark_errors_in(self, filename):
         errors = self._error_report.sorted_errors_in(filename)
         for view in self._file_views(filename):
             self._mark_errors_in_view(view, errors)
 
-    @delayed(0)
+    @deferred()
+    def mark_errors_in_files(self, filenames):
+        for view in self._window.views():
+            if view.file_name() in filenames:
+                errors = self._error_report.sorted_errors_in(view.file_name())
+                self._mark_errors_in_view(view, errors)
+
+    @deferred(key=lambda self, filename: (self, filename))
     def hide_errors_in(self, filename):
         for view in self._file_views(filename):
             self._highlighter.clear(view)
 
-    @delayed(0)
-    def mark_error(self, error):
-        for view in self._file_views(error.filename):
-            self._highlighter.highlight(view, [error])
+    @deferred()
+    def mark_new_errors(self, errors):
+        errors = [e for e in errors if e.filename]
+        for filename, file_errors in group_by(errors, lambda e: e.filename).items():
+            for view in self._file_views(filename):
+                self._highlighter.highlight(view, file_errors)
 
-    @delayed(0)
+    @deferred(key=lambda self: self)
     def clear(self):
         for view in self._window.views():
             self._highlighter.clear(view)
 
-    @delayed(0)
+    @deferred(key=lambda self: self)
     def update_status(self):
         self.update_status_now()
 
@@ -69,6 +78,10 @@ class ErrorMarker(object):
         row, _ = view.rowcol(view.sel()[0].begin())
         return self._error_report.errors_at(view.file_name(), row + 1)
 
+    def view_closed(self, view_id):
+        for highlighter in maybe(self.__highlighter):
+            highlighter.forget(view_id)
+
     def _current_error_in_view(self, view):
         return self._error_report.current_error_in(view.file_name())
 
@@ -5,66 +5,107 @@ except(ValueError):
     from sbterror import SbtError
     from util import maybe
 
+from bisect import bisect_left, bisect_right, insort
+
 
 class ErrorReport(object):
 
+    # Errors are indexed by a sorted list of (filename, line, error_type, seq)
+    # keys that is kept up to date as errors are added and files are dropped,
+    # so navigation is a bisection rather than a sort of every error.
+
     def __init__(self):
         self._errors = {}
         self._old_errors = {}
         self._new_errors = {}
+        self._keys = []
+        self._errors_by_key = {}
+        self._keys_by_error = {}
+        self._seq = 0
         self._set_current(None)
 
     def clear(self):
         self._errors.clear()
         self._old_errors.clear()
         self._new_errors.clear()
+        del self._keys[:]
+        self._errors_by_key.clear()
+        self._keys_by_error.clear()
         self._set_current(None)
 
     def add_error(self, error):
-        if error.filename:
-            if error.filename not in self._new_errors:
-                self._new_errors[error.filename] = {}
-            file_errors = self._new_errors[error.filename]
-            if error.line not in file_errors:
-                file_errors[error.line] = []
-            file_errors[error.line].append(error)
-            self._merge_errors()
+        self.add_errors([error])
+
+    def add_errors(self, errors):
+        added = False
+        for error in errors:
+            if error.filename:
+                if error.filename not in self._new_errors:
+                    self._unindex_file(error.filename)
+                    self._new_errors[error.filename] = {}
+                    self._errors[error.filename] = self._new_errors[error.filename]
+                file_errors = self._new_errors[error.filename]
+                if error.line not in file_errors:
+                    file_errors[error.line] = []
+                file_errors[error.line].append(error)
+                self._index_error(error)
+                added = True
+        if added:
+            self._set_current(None)
+
+    def replace_errors_in(self, filename, errors):
+        self.clear_file(filename)
+        self.add_errors(errors)
 
     def cycle(self):
+        diff = ErrorReportDiff()
+        for filename in list(self._errors.keys()):
+            if filename not in self._new_errors:
+                self._unindex_file(filename)
+                diff.removed.add(filename)
+        for filename, errors in self._new_errors.items():
+            if filename not in self._old_errors:
+                diff.added.add(filename)
+            elif self._signature(errors) != self._signature(self._old_errors[filename]):
+                diff.changed.add(filename)
+            else:
+                diff.unchanged.add(filename)
+        for error in maybe(self.current_error):
+            if error.filename in diff.unchanged:
+                diff.unchanged.remove(error.filename)
+                diff.changed.add(error.filename)
         self._old_errors = self._new_errors
         self._new_errors = {}
-        self._merge_errors()
+        self._errors = dict(self._old_errors)
+        self._set_current(None)
+        return diff
 
     def all_errors(self):
-        for filename in sorted(self._errors.keys()):
-            for error in self.sorted_errors_in(filename):
-                yield error
+        for key in self._keys:
+            yield self._errors_by_key[key]
+
+    def error_count(self):
+        return len(self._keys)
 
     def focus_error(self, error):
-        for i, e in enumerate(self.all_errors()):
-            if e == error:
-                self._set_current(i)
+        for key in maybe(self._keys_by_error.get(error)):
+            self._set_current(key)
 
     def next_error(self):
-        sorted_errors = list(self.all_errors())
-        if sorted_errors:
-            if self._index is None:
-                self._set_current(0)
+        if self._keys:
+            if self._current_key is None:
+                self._set_current(self._keys[0])
             else:
-                self._set_current((self._index + 1) % len(sorted_errors))
+                i = bisect_right(self._keys, self._current_key)
+                self._set_current(self._keys[i % len(self._keys)])
         else:
             self._set_current(None)
         return self.current_error
 
     def sorted_errors_in(self, filename):
-
-        def sort_errors(errors):
-            for line in sorted(errors.keys()):
-                for error in sorted(errors[line], key=lambda e: e.error_type):
-                    yield error
-
-        for errors in maybe(self.errors_in(filename)):
-            return list(sort_errors(errors))
+        if filename in self._errors:
+            lo, hi = self._file_range(filename)
+            return [self._errors_by_key[k] for k in self._keys[lo:hi]]
 
     def errors_at(self, filename, line):
         for errors in maybe(self.errors_in(filename)):
@@ -84,19 +125,54 @@ class ErrorReport(object):
                 del errors[filename]
         if self.current_error_in(filename):
             self._set_current(None)
+        self._unindex_file(filename)
 
     def has_errors(self):
         return len(self._errors) > 0
 
-    def _merge_errors(self):
-        self._errors = dict(list(self._old_errors.items()) + list(self._new_errors.items()))
-        self._set_current(None)
-
-    def _set_current(self, i):
-        sorted_errors = list(self.all_errors())
-        if i is not None and i < len(sorted_errors):
-            self._index = i
-            self.current_error = sorted_errors[i]
+    def _signature(self, file_errors):
+        return sorted((line, e.error_type, e.message, e.column_spec)
+                      for line, errors in file_errors.items() for e in errors)
+
+    def _index_error(self, error):
+        self._seq += 1
+        key = (error.filename, error.line, error.error_type, self._seq)
+        insort(self._keys, key)
+        self._errors_by_key[key] = error
+        self._keys_by_error[error] = key
+
+    def _unindex_file(self, filename):
+        lo, hi = self._file_range(filename)
+        for key in self._keys[lo:hi]:
+            del self._keys_by_error[self._errors_by_key.pop(key)]
+            if key == self._current_key:
+                self._set_current(None)
+        del self._keys[lo:hi]
+
+    def _file_range(self, filename):
+        return (bisect_left(self._keys, (filename,)),
+                bisect_left(self._keys, (filename, float('inf'))))
+
+    def _set_current(self, key):
+        if key is not None:
+            self._current_key = key
+            self.current_error = self._errors_by_key[key]
         else:
-            self._index = None
+            self._current_key = None
             self.current_error = None
+
+
+class ErrorReportDiff(object):
+
+    # How the files with errors changed in a cycle. A file is changed if its
+    # errors differ from the previous cycle's, or if it had the current
+    # error, since cycling moves the current error off it.
+
+    def __init__(self):
+        self.added = set()
+        self.removed = set()
+        self.changed = set()
+        self.unchanged = set()
+
+    def dirty(self):
+        return self.added | self.removed | self.changed
@@ -1,9 +1,7 @@
 try:
     from .errormarker import ErrorMarker
-    from .util import delayed
 except(ValueError):
     from errormarker import ErrorMarker
-    from util import delayed
 
 
 class ErrorReporter(object):
@@ -13,13 +11,21 @@ class ErrorReporter(object):
         self._error_report = error_report
 
     def error(self, error):
-        self._error_report.add_error(error)
-        self._marker.mark_error(error)
+        self.errors([error])
+
+    def errors(self, errors):
+        self._error_report.add_errors(errors)
+        self._marker.mark_new_errors(errors)
+        self._marker.update_status()
+
+    def replace_errors_in(self, filename, errors):
+        self._error_report.replace_errors_in(filename, errors)
+        self._marker.mark_errors_in(filename)
         self._marker.update_status()
 
     def finish(self):
-        self._error_report.cycle()
-        self._marker.mark_errors()
+        diff = self._error_report.cycle()
+        self._marker.mark_errors_in_files(diff.dirty())
 
     def clear(self):
         self._error_report.clear()
@@ -40,3 +46,6 @@ class ErrorReporter(object):
 
     def update_status_now(self):
         self._marker.update_status_now()
+
+    def view_closed(self, view_id):
+        self._marker.view_closed(view_id)
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+
+
+class FileIndex(object):
+
+    # Maps file basenames to their paths under a project root. The index is
+    # built in the background and refreshed incrementally: directories are
+    # stat'ed and only those whose mtime has changed are listed again. find
+    # only reads the map, so it never waits for a refresh and is safe on the
+    # main thread; a miss starts a background refresh, at most once per
+    # min_refresh_interval. resolve is for worker threads: on a miss it waits
+    # for the refresh in flight, or refreshes in the calling thread, and looks
+    # again. Paths are only returned while they still exist.
+
+    skip_dirs = frozenset(['target', '.git'])
+
+    def __init__(self, root, min_refresh_interval=2.0):
+        self.root = root
+        self._min_refresh_interval = min_refresh_interval
+        self._dirs = {}
+        self._paths = {}
+        self._refreshed_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self.refresh_later()
+
+    def find(self, basename):
+        for path in self._existing_paths(basename):
+            return path
+        self.refresh_later()
+
+    def resolve(self, basename):
+        for path in self._existing_paths(basename):
+            return path
+        with self._lock:
+            while self._refreshing:
+                self._refreshed.wait()
+            stale = self._is_stale()
+            if stale:
+                self._refreshing = True
+        if stale:
+            self._refresh()
+        for path in self._existing_paths(basename):
+            return path
+
+    def refresh_later(self):
+        with self._lock:
+            if self._refreshing or not self._is_stale():
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._refresh)
+        thread.daemon = True
+        thread.start()
+
+    def _refresh(self):
+        try:
+            seen = set()
+            pending = [self.root]
+            while pending:
+                path = pending.pop()
+                seen.add(path)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                entry = self._dirs.get(path)
+                if entry is None or entry[0] != mtime:
+                    entry = self._list_dir(path, mtime)
+                pending.extend(entry[2])
+            with self._lock:
+                for path in list(self._dirs.keys()):
+                    if path not in seen:
+                        self._forget_dir(path)
+        finally:
+            with self._lock:
+                self._refreshed_at = time.time()
+                self._refreshing = False
+                self._refreshed.notify_all()
+
+    def _is_stale(self):
+        return (self._refreshed_at is None or
+                time.time() - self._refreshed_at >= self._min_refresh_interval)
+
+    def _existing_paths(self, basename):
+        with self._lock:
+            paths = sorted(self._paths.get(basename, ()), key=lambda p: (p.count(os.sep), p))
+        existing = [p for p in paths if os.path.exists(p)]
+        if len(existing) < len(paths):
+            self.refresh_later()
+        return existing
+
+    def _list_dir(self, path, mtime):
+        files, subdirs = [], []
+        try:
+            names = os.listdir(path)
+        except OSError:
+            names = []
+        for name in names:
+            full_path = os.path.join(path, name)
+            if os.path.isdir(full_path):
+                if name not in type(self).skip_dirs and not os.path.islink(full_path):
+                    subdirs.append(full_path)
+            else:
+                files.append(name)
+        with self._lock:
+            self._forget_dir(path)
+            for name in files:
+                self._paths.setdefault(name, set()).add(os.path.join(path, name))
+            self._dirs[path] = entry = (mtime, files, subdirs)
+        return entry
+
+    def _forget_dir(self, path):
+        entry = self._dirs.pop(path, None)
+        if entry is not None:
+            for name in entry[1]:
+                paths = self._paths.get(name)
+                if paths is not None:
+                    paths.discard(os.path.join(path, name))
+                    if not paths:
+                        del self._paths[name]
@@ -5,16 +5,34 @@ try:
 except(ValueError):
     from util import group_by, maybe
 
+import time
+
 
 class CodeHighlighter(object):
 
+    # Keeps a model of the marked lines of each view, so that marking errors
+    # only changes the lines that are new or gone and redraws only the error
+    # types that changed, each with a single add_regions. Regions move with
+    # edits, so after a view is edited the model is refreshed from the
+    # view's regions once.
+    #
+    # Files with many errors are highlighted lazily: the lines in the
+    # viewport are marked at once and the rest are filled in by later steps
+    # that each take at most slice_time seconds. Past the outline_limit
+    # setting only gutter dots are drawn, which don't need the lines' text
+    # to be searched.
+
     error_types = ['error', 'failure', 'warning']
 
+    chunk_size = 200
+    slice_time = 0.005
+
     def __init__(self, settings, current_error_in_view):
         self.settings = settings
         self._current_error_in_view = current_error_in_view
         self.bookmark_key = 'sublimesbt_bookmark'
         self.status_key = 'SBT'
+        self._marks = {}
         self._update_highlight_args()
         settings.add_on_change(self._update_highlight_args)
 
@@ -25,17 +43,32 @@ class CodeHighlighter(object):
             view.erase_status(self.status_key)
 
     def clear(self, view):
+        self._marks.pop(view.id(), None)
         view.erase_regions(self.bookmark_key)
         for error_type in type(self).error_types:
             view.erase_regions(self.region_key(error_type))
 
+    def forget(self, view_id):
+        self._marks.pop(view_id, None)
+
     def highlight(self, view, errors, replace=False):
-        bookmarked_line = self._bookmark_error(view)
+        marks = self._view_marks(view)
         grouped = group_by(errors, lambda e: e.error_type)
+        changed = set(marks.stale)
+        marks.stale.clear()
+        if replace:
+            marks.fill = None
+        self._update_mode(marks, len(errors), replace, changed)
+        for error_type in type(self).error_types:
+            lines = set(e.line for e in grouped.get(error_type, list()))
+            if replace and marks.retain(error_type, lines):
+                changed.add(error_type)
+            if marks.add(error_type, lines):
+                changed.add(error_type)
+        changed.update(self._bookmark_error(view, marks))
         for error_type in type(self).error_types:
-            lines = [e.line for e in grouped.get(error_type, list())]
-            lines = [l for l in lines if l != bookmarked_line]
-            self._highlight_lines(view, lines, error_type, replace)
+            if error_type in changed:
+                self._highlight_lines(view, marks, error_type)
 
     def region_key(self, error_type):
         return 'sublimesbt_%s_marking' % error_type
@@ -43,43 +76,115 @@ class CodeHighlighter(object):
     def region_scope(self, error_type):
         return self._mark_settings(error_type)['scope']
 
-    def _bookmark_error(self, view):
+    def _view_marks(self, view):
+        marks = self._marks.get(view.id())
+        if marks is None:
+            marks = self._marks[view.id()] = ViewMarks()
+        if marks.change_count != view.change_count():
+            self._refresh_marks(view, marks)
+        return marks
+
+    def _refresh_marks(self, view, marks):
+        for error_type in type(self).error_types:
+            marks.regions[error_type] = dict(
+                (view.rowcol(r.begin())[0] + 1, r)
+                for r in view.get_regions(self.region_key(error_type)))
+        if marks.bookmark is not None:
+            line, error_type = marks.bookmark
+            marks.pending[error_type].add(line)
+        marks.bookmark = None
+        marks.stale.update(type(self).error_types)
+        marks.change_count = view.change_count()
+
+    def _update_mode(self, marks, count, replace, changed):
+        if not replace:
+            count += marks.count()
+        limit = self.settings.get_int('outline_limit')
+        gutter_only = limit > 0 and count > limit
+        if gutter_only != marks.gutter_only:
+            marks.gutter_only = gutter_only
+            for error_type in type(self).error_types:
+                if marks.forget_regions(error_type):
+                    changed.add(error_type)
+
+    def _bookmark_error(self, view, marks):
+        bookmark = None
         for error in maybe(self._current_error_in_view(view)):
-            region = self._create_region(view, error.line)
-            self._clear_highlight(view, region)
+            bookmark = (error.line, error.error_type)
+        if bookmark == marks.bookmark:
+            return []
+        changed = marks.types_marking(marks.bookmark) + marks.types_marking(bookmark)
+        marks.bookmark = bookmark
+        if bookmark is None:
+            view.erase_regions(self.bookmark_key)
+        else:
+            line, error_type = bookmark
             view.add_regions(self.bookmark_key,
-                             [region],
-                             self.region_scope(error.error_type),
-                             *self._bookmark_args(error.error_type))
-            return error.line
+                             [self._create_region(view, line)],
+                             self.region_scope(error_type),
+                             *self._bookmark_args(error_type))
+        return changed
 
-    def _highlight_lines(self, view, lines, error_type, replace):
-        regions = self._all_regions(view, self._create_regions(view, lines), error_type, replace)
-        self._highlight_regions(view, regions, error_type)
+    def _highlight_lines(self, view, marks, error_type):
+        pending = marks.pending[error_type]
+        if pending:
+            lines = self._visible_first(view, sorted(pending))
+            self._create_regions(view, marks, error_type, lines[:type(self).chunk_size])
+            if pending:
+                self._fill_later(view, marks)
+        self._highlight_regions(view, marks, error_type)
 
-    def _highlight_regions(self, view, regions, error_type):
+    def _highlight_regions(self, view, marks, error_type):
+        if marks.gutter_only:
+            args = ['dot', sublime.HIDDEN]
+        else:
+            args = self._highlight_args[error_type]
         view.add_regions(self.region_key(error_type),
-                         regions,
+                         marks.visible_regions(error_type),
                          self.region_scope(error_type),
-                         *self._highlight_args[error_type])
+                         *args)
 
-    def _clear_highlight(self, view, region):
-        for error_type in type(self).error_types:
-            regions = view.get_regions(self.region_key(error_type))
-            if region in regions:
-                regions = [r for r in regions if r != region]
-                self._highlight_regions(view, regions, error_type)
+    def _fill_later(self, view, marks):
+        if marks.fill is None:
+            fill = marks.fill = object()
 
-    def _all_regions(self, view, new_regions, error_type, replace):
-        if replace:
-            return new_regions
-        else:
-            return view.get_regions(self.region_key(error_type)) + new_regions
+            def fill_step():
+                if marks.fill is fill and self._marks.get(view.id()) is marks:
+                    if marks.change_count != view.change_count():
+                        marks.fill = None
+                        return
+                    deadline = time.time() + type(self).slice_time
+                    for error_type in type(self).error_types:
+                        pending = marks.pending[error_type]
+                        if pending and time.time() < deadline:
+                            lines = sorted(pending)
+                            while lines and time.time() < deadline:
+                                self._create_regions(view, marks, error_type, lines[-50:])
+                                del lines[-50:]
+                            self._highlight_regions(view, marks, error_type)
+                    if any(marks.pending.values()):
+                        sublime.set_timeout(fill_step, 0)
+                    else:
+                        marks.fill = None
+
+            sublime.set_timeout(fill_step, 0)
 
-    def _create_regions(self, view, lines):
-        return [self._create_region(view, l) for l in lines]
+    def _visible_first(self, view, lines):
+        visible = view.visible_region()
+        first = view.rowcol(visible.begin())[0] + 1
+        last = view.rowcol(visible.end())[0] + 1
+        return sorted(lines, key=lambda l: not first <= l <= last)
 
-    def _create_region(self, view, lineno):
+    def _create_regions(self, view, marks, error_type, lines):
+        regions = marks.regions[error_type]
+        pending = marks.pending[error_type]
+        for line in lines:
+            pending.discard(line)
+            regions[line] = self._create_region(view, line, marks.gutter_only)
+
+    def _create_region(self, view, lineno, gutter_only=False):
+        if gutter_only:
+            return sublime.Region(view.text_point(lineno - 1, 0))
         line = view.line(view.text_point(lineno - 1, 0))
         r = view.find(r'\S', line.begin())
         if r is not None and line.contains(r):
@@ -96,6 +201,8 @@ class CodeHighlighter(object):
             'failure': self._create_highlight_args('failure'),
             'warning': self._create_highlight_args('warning')
         }
+        for marks in self._marks.values():
+            marks.stale.update(type(self).error_types)
 
     def _create_highlight_args(self, error_type):
         style = self._mark_settings(error_type)['style']
@@ -108,3 +215,55 @@ class CodeHighlighter(object):
 
     def _mark_settings(self, error_type):
         return self.settings.get('%s_marking' % error_type)
+
+
+class ViewMarks(object):
+
+    # The marked lines of a view for each error type: lines with a region
+    # and lines whose regions are still to be created. The bookmarked line
+    # keeps its place under its error type but isn't drawn there.
+
+    def __init__(self):
+        self.regions = dict((t, {}) for t in CodeHighlighter.error_types)
+        self.pending = dict((t, set()) for t in CodeHighlighter.error_types)
+        self.bookmark = None
+        self.gutter_only = None
+        self.change_count = None
+        self.stale = set()
+        self.fill = None
+
+    def count(self):
+        return sum(len(self.regions[t]) + len(self.pending[t]) for t in self.regions)
+
+    def add(self, error_type, lines):
+        regions = self.regions[error_type]
+        pending = self.pending[error_type]
+        new_lines = [l for l in lines if l not in regions and l not in pending]
+        pending.update(new_lines)
+        return len(new_lines) > 0
+
+    def retain(self, error_type, lines):
+        regions = self.regions[error_type]
+        pending = self.pending[error_type]
+        gone = [l for l in regions if l not in lines]
+        for line in gone:
+            del regions[line]
+        pending_count = len(pending)
+        pending.intersection_update(lines)
+        return len(gone) > 0 or len(pending) < pending_count
+
+    def forget_regions(self, error_type):
+        regions = self.regions[error_type]
+        self.pending[error_type].update(regions)
+        regions.clear()
+        return len(self.pending[error_type]) > 0
+
+    def types_marking(self, bookmark):
+        if bookmark is None:
+            return []
+        line, _ = bookmark
+        return [t for t in self.regions if line in self.regions[t] or line in self.pending[t]]
+
+    def visible_regions(self, error_type):
+        bookmarked_line = self.bookmark and self.bookmark[0]
+        return [r for l, r in self.regions[error_type].items() if l != bookmarked_line]
@@ -0,0 +1,163 @@
+import os
+import select
+import threading
+import time
+import traceback
+
+
+class IOLoop(object):
+
+    # A single thread that multiplexes the output pipes of every running sbt
+    # process and reaps the processes when they exit, so the number of
+    # threads doesn't grow with the number of windows. The thread exits when
+    # nothing is registered and is restarted by the next registration.
+    # Callbacks run on the loop thread and must not block for long, since a
+    # blocked callback stalls every process. A callback whose consumer can't
+    # keep up calls pause_reader instead, which stops the loop reading that
+    # one pipe until the consumer is ready for more.
+
+    reap_interval = 0.5
+    exit_grace = 2.0
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def in_loop_thread(cls):
+        loop = cls._instance
+        return loop is not None and threading.current_thread() is loop._thread
+
+    def __init__(self):
+        self._readers = {}
+        self._procs = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._paused = {}
+        self._reading = None
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self.wakeups = 0
+        self.bytes_read = 0
+        self.busy_time = 0.0
+
+    def add_reader(self, pipe, handle_data):
+        with self._lock:
+            self._readers[pipe.fileno()] = (pipe, handle_data)
+            self._start()
+
+    def add_process(self, proc, pipes, on_exit):
+        with self._lock:
+            self._procs.append([proc, [p.fileno() for p in pipes], on_exit, None])
+            self._start()
+
+    def pause_reader(self, ready):
+        # Only called from a callback on the loop thread: the pipe whose data
+        # is being handled isn't read again until ready() returns true.
+        self._paused[self._reading] = ready
+
+    def wakeup(self):
+        with self._lock:
+            if self._thread is not None:
+                os.write(self._wakeup_write, b'.')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'readers': len(self._readers),
+                'paused': len(self._paused),
+                'processes': len(self._procs),
+                'wakeups': self.wakeups,
+                'bytes_read': self.bytes_read,
+                'busy_time': self.busy_time
+            }
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            os.write(self._wakeup_write, b'.')
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            # Whether the loop ran out of work or failed, the next
+            # registration must start a new thread.
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if not self._readers and not self._procs:
+                    return
+                fds = list(self._readers.keys())
+                timeout = self.reap_interval if self._procs else None
+            fds = [fd for fd in fds if not self._is_paused(fd)]
+            if self._paused:
+                timeout = self.reap_interval
+            ready, _, _ = select.select(fds + [self._wakeup_read], [], [], timeout)
+            started_at = time.time()
+            for fd in ready:
+                if fd == self._wakeup_read:
+                    os.read(self._wakeup_read, 4096)
+                else:
+                    self._read(fd)
+            self._reap()
+            self.wakeups += 1
+            self.busy_time += time.time() - started_at
+
+    def _read(self, fd):
+        pipe, handle_data = self._readers[fd]
+        try:
+            data = os.read(fd, 2 ** 15)
+        except OSError:
+            data = b''
+        self.bytes_read += len(data)
+        self._reading = fd
+        try:
+            handle_data(data)
+        except Exception:
+            # A failing reader is dropped rather than taking down the loop
+            # and with it every other process's output.
+            traceback.print_exc()
+            data = b''
+        finally:
+            self._reading = None
+        if not data:
+            with self._lock:
+                del self._readers[fd]
+            self._paused.pop(fd, None)
+            pipe.close()
+
+    def _is_paused(self, fd):
+        ready = self._paused.get(fd)
+        if ready is not None and ready():
+            del self._paused[fd]
+            ready = None
+        return ready is not None
+
+    def _reap(self):
+        now = time.time()
+        for entry in list(self._procs):
+            proc, fds, on_exit, exited_at = entry
+            if exited_at is None and proc.poll() is not None:
+                entry[3] = exited_at = now
+            if exited_at is not None:
+                open_fds = [fd for fd in fds if fd in self._readers]
+                if not open_fds or now - exited_at >= self.exit_grace:
+                    with self._lock:
+                        self._procs.remove(entry)
+                    try:
+                        on_exit()
+                    except Exception:
+                        traceback.print_exc()
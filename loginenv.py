@@ -0,0 +1,181 @@
+import sublime
+
+try:
+    from .util import load_json, maybe, save_json
+except(ValueError):
+    from util import load_json, maybe, save_json
+
+import hashlib
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+
+
+class LoginEnvironment(object):
+
+    # The environment of the user's login shell, captured once and cached in
+    # memory and on disk, keyed by a hash of the shell's profile files. While
+    # the profiles are unchanged sbt can be started directly with this
+    # environment instead of through `$SHELL -lic`. When they change the
+    # snapshot is stale: it is recaptured in the background and the shell
+    # wrapper is used in the meantime. The snapshot can hold credentials, so
+    # its file is only readable by the user. A shell that takes longer than
+    # capture_timeout seconds, e.g. one waiting at a prompt, is killed. The
+    # variables that describe the capturing shell's own session, such as its
+    # working directory, are left out, as they'd be wrong for sbt, which is
+    # started in the project's directory.
+
+    profile_files = [
+        '/etc/profile', '/etc/bashrc', '/etc/zshenv', '/etc/zprofile', '/etc/zshrc',
+        '~/.profile', '~/.bash_profile', '~/.bash_login', '~/.bashrc',
+        '~/.zshenv', '~/.zprofile', '~/.zshrc', '~/.zlogin',
+        '~/.login', '~/.cshrc', '~/.tcshrc'
+    ]
+
+    marker = '__SublimeSBT_environment__'
+
+    capture_timeout = 30
+
+    session_variables = frozenset(['PWD', 'OLDPWD', 'SHLVL', '_'])
+
+    _snapshot = None
+    _loaded = False
+    _capturing = False
+    _lock = threading.Lock()
+
+    @classmethod
+    def current(cls):
+        key = cls._profile_key()
+        with cls._lock:
+            if not cls._loaded:
+                cls._snapshot = cls._load()
+                cls._loaded = True
+            if cls._snapshot is not None and cls._snapshot.key == key:
+                return cls._snapshot
+            if not cls._capturing:
+                cls._capturing = True
+                thread = threading.Thread(target=cls._capture, args=(key,))
+                thread.daemon = True
+                thread.start()
+
+    @classmethod
+    def shell_cmdline(cls, command):
+        shell = os.environ.get('SHELL', '/bin/bash')
+        opts = '-ic' if shell.endswith('csh') else '-lic'
+        return [shell, opts, command]
+
+    @classmethod
+    def _profile_key(cls):
+        digest = hashlib.md5(os.environ.get('SHELL', '').encode('utf-8'))
+        for path in cls.profile_files:
+            path = os.path.expanduser(path)
+            try:
+                with open(path, 'rb') as f:
+                    digest.update(path.encode('utf-8'))
+                    digest.update(f.read())
+            except (IOError, OSError):
+                pass
+        return digest.hexdigest()
+
+    @classmethod
+    def _capture(cls, key):
+        snapshot = None
+        try:
+            started_at = time.time()
+            proc = subprocess.Popen(cls.shell_cmdline('echo %s; env' % cls.marker),
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    preexec_fn=os.setpgrp)
+            timer = threading.Timer(cls.capture_timeout, cls._kill, (proc,))
+            timer.start()
+            try:
+                output, _ = proc.communicate()
+            finally:
+                timer.cancel()
+            variables = cls._parse_env(output.decode('utf-8', 'replace'))
+            if proc.returncode == 0 and 'PATH' in variables:
+                snapshot = EnvironmentSnapshot(key, variables, time.time() - started_at)
+                cls._save(snapshot)
+        except (IOError, OSError):
+            pass
+        finally:
+            with cls._lock:
+                if snapshot is not None:
+                    cls._snapshot = snapshot
+                cls._capturing = False
+
+    @classmethod
+    def _kill(cls, proc):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    @classmethod
+    def _parse_env(cls, output):
+        variables = {}
+        name = None
+        lines = output.split('\n')
+        if cls.marker in lines:
+            for line in lines[lines.index(cls.marker) + 1:]:
+                m = re.match(r'([A-Za-z_][A-Za-z0-9_]*)=(.*)$', line)
+                if m:
+                    name = m.group(1)
+                    variables[name] = m.group(2)
+                elif name is not None:
+                    variables[name] += '\n' + line
+        return cls._without_session_variables(variables)
+
+    @classmethod
+    def _without_session_variables(cls, variables):
+        return dict((name, value) for name, value in variables.items()
+                    if name not in cls.session_variables)
+
+    @classmethod
+    def _cache_file(cls):
+        if hasattr(sublime, 'cache_path'):
+            return os.path.join(sublime.cache_path(), 'SublimeSBT', 'login_environment.json')
+
+    @classmethod
+    def _load(cls):
+        for data in maybe(load_json(cls._cache_file())):
+            try:
+                return EnvironmentSnapshot(data['key'],
+                                           cls._without_session_variables(data['variables']),
+                                           data['startup_time'])
+            except (AttributeError, KeyError, TypeError):
+                pass
+
+    @classmethod
+    def _save(cls, snapshot):
+        save_json(cls._cache_file(),
+                  {'key': snapshot.key,
+                   'variables': snapshot.variables,
+                   'startup_time': snapshot.startup_time},
+                  mode=0o600)
+
+
+class EnvironmentSnapshot(object):
+
+    def __init__(self, key, variables, startup_time):
+        self.key = key
+        self.variables = variables
+        self.startup_time = startup_time
+        self._executables = {}
+
+    def which(self, name):
+        if os.sep in name:
+            return name
+        if name not in self._executables:
+            self._executables[name] = self._find_executable(name)
+        return self._executables[name]
+
+    def _find_executable(self, name):
+        for folder in self.variables.get('PATH', '').split(os.pathsep):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
@@ -1,27 +1,49 @@
 try:
+    from .ioloop import IOLoop
     from .sbterror import SbtError
-    from .util import maybe
+    from .util import deferred, maybe
 except(ValueError):
+    from ioloop import IOLoop
     from sbterror import SbtError
-    from util import maybe
+    from util import deferred, maybe
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import functools
 import re
+import threading
 
 
 class BuildOutputMonitor(object):
 
-    def __init__(self, project):
+    # Parses output that has already been through an OutputNormalizer. When
+    # server_diagnostics returns true the output comes from an sbt server,
+    # which publishes compile errors as diagnostics, so only test failures
+    # are parsed from it.
+
+    def __init__(self, project, reporter=None, timings=None, server_diagnostics=None):
         self.project = project
-        self._parsers = [ErrorParser, TestFailureParser, MultilineTestFailureParser,
-                         FinishedParser]
+        self._timings = timings
+        self._server_diagnostics = server_diagnostics
+        self._reporter = DeferredReporter(reporter or project.error_reporter, timings)
+        self._dispatcher = LineDispatcher([ErrorParser, TestFailureParser,
+                                           MultilineTestFailureParser, FinishedParser])
+        self._test_dispatcher = LineDispatcher([TestFailureParser, MultilineTestFailureParser,
+                                                FinishedParser])
         self._parser = None
-        self._buffer = ''
+        self._lines = LineSplitter()
 
     def __call__(self, output):
-        lines = re.split(r'(?:\r\n|\n|\r)', self._buffer + output)
-        self._buffer = lines[-1]
-        for line in lines[0:-1]:
-            self._output_line(self._strip_terminal_codes(line))
+        for timings in maybe(self._timings):
+            timings.output(output)
+        for line in self._lines(output):
+            self._output_line(line)
+
+    def flush(self):
+        self._reporter.flush()
 
     def _output_line(self, line):
         if self._parser:
@@ -30,25 +52,253 @@ class BuildOutputMonitor(object):
             self._parser = self._start_parsing(line)
 
     def _start_parsing(self, line):
-        for parser_class in self._parsers:
-            for parser in parser_class.start(self.project, line):
+        for parser_class in maybe(self._line_dispatcher().classify(line)):
+            for parser in parser_class.start(self.project, self._reporter, line):
                 return parser
 
-    def _strip_terminal_codes(self, line):
-        return re.sub(r'\033(?:M|\[[0-9;]+[mK])', '', line)
+    def _line_dispatcher(self):
+        if self._server_diagnostics is not None and self._server_diagnostics():
+            return self._test_dispatcher
+        else:
+            return self._dispatcher
+
+
+class OutputParserWorker(object):
+
+    # Runs a BuildOutputMonitor on its own thread, fed by a reader through a
+    # queue of at most maxsize chunks. When the parser falls behind, a reader
+    # on the IOLoop thread has the loop stop reading its pipe until the queue
+    # has room again, so other processes' pipes are still read; any other
+    # reader waits for room. Either way sbt's pipe stops being drained.
+    # Callbacks queued by after_parsing skip the limit, so the main thread
+    # never waits for room. The thread exits when idle and is restarted by
+    # the next output.
+
+    def __init__(self, monitor, maxsize=64, idle_timeout=10):
+        self._monitor = monitor
+        self._queue = queue.Queue()
+        self._maxsize = maxsize
+        self._idle_timeout = idle_timeout
+        self._thread = None
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        self._reader_paused = False
+
+    def __call__(self, output):
+        with self._lock:
+            self._put(output)
+            if self._has_room():
+                return
+            if not IOLoop.in_loop_thread():
+                while not self._has_room():
+                    self._room.wait()
+                return
+            self._reader_paused = True
+        IOLoop.instance().pause_reader(self._has_room)
+
+    def after_parsing(self, callback):
+        with self._lock:
+            self._put(callback)
+
+    def _put(self, item):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(item)
+
+    def _run(self):
+        while True:
+            try:
+                output = self._queue.get(timeout=self._idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            self._made_room()
+            self._handle(output)
+            for output in self._drain():
+                self._made_room()
+                self._handle(output)
+            self._monitor.flush()
+
+    def _has_room(self):
+        return self._queue.qsize() < self._maxsize
+
+    def _made_room(self):
+        with self._lock:
+            self._room.notify_all()
+            reader_paused, self._reader_paused = self._reader_paused, False
+        if reader_paused:
+            IOLoop.instance().wakeup()
+
+    def _handle(self, output):
+        if callable(output):
+            self._monitor.flush()
+            self._call_later(output)
+        else:
+            self._monitor(output)
+
+    @deferred()
+    def _call_later(self, callback):
+        callback()
+
+    def _drain(self):
+        for _ in range(self._maxsize):
+            try:
+                yield self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class DeferredReporter(object):
+
+    # Collects what the parsers report on the worker thread and replays it on
+    # the main thread in one callback per flush, with consecutive errors
+    # delivered as a single batch. The error report is owned by the main
+    # thread and is never touched from the worker. Command timings, when
+    # given, are told about errors as soon as they're parsed and about the
+    # end of a command as soon as sbt reports its total time.
+
+    def __init__(self, reporter, timings=None):
+        self._reporter = reporter
+        self._timings = timings
+        self._pending = []
+        self._batch = None
+
+    def error(self, error):
+        for timings in maybe(self._timings):
+            timings.error()
+        if self._batch is None:
+            self._batch = []
+            self._pending.append(functools.partial(self._reporter.errors, self._batch))
+        self._batch.append(error)
+
+    def finished(self, total_time, success=True):
+        for timings in maybe(self._timings):
+            timings.finished(total_time, success)
+
+    def finish(self):
+        self._batch = None
+        self._pending.append(self._reporter.finish)
+
+    def flush(self):
+        self._batch = None
+        if self._pending:
+            self._deliver(self._pending)
+            self._pending = []
+
+    @deferred()
+    def _deliver(self, pending):
+        for report in pending:
+            report()
+
+
+class OutputNormalizer(object):
+
+    # Cleans up a stream of sbt's output once, for both the parsers and the
+    # output panel: CRLFs become LFs, reverse line feeds become CRs and
+    # colour and erase codes are removed, with each step skipped when the
+    # chunk has nothing for it to do. A CR or escape sequence at the end of a
+    # chunk is held back until the next chunk, so a CRLF or escape sequence
+    # split between chunks is still recognised.
+    #
+    # A chunk that's a single character, space, CR is probably a JLine bug
+    # which has inserted the space, CR at column 80 of a prompt line. The
+    # space, CR pair is removed so that it doesn't hide the stuff before the
+    # CR.
+
+    codes = re.compile(r'\033\[[0-9;]*[mK]')
+    incomplete = re.compile(r'\r\Z|\033(?:\[[0-9;]*)?\Z')
+
+    def __init__(self):
+        self._held = ''
+
+    def __call__(self, output):
+        if len(output) == 3 and output.endswith(' \r') and output[0] != '\n':
+            output = output[0]
+        output = self._held + output
+        self._held = ''
+        if output.endswith('\r') or '\033' in output[-16:]:
+            for m in maybe(type(self).incomplete.search(output, max(0, len(output) - 16))):
+                self._held = m.group()
+                output = output[:m.start()]
+        if '\r' in output:
+            output = output.replace('\r\n', '\n')
+        if '\033' in output:
+            output = type(self).codes.sub('', output.replace('\033M', '\r'))
+        return output
+
+
+class LineSplitter(object):
+
+    # Splits streamed text into complete lines. Only newly arrived text is
+    # scanned for terminators; an unterminated tail is kept as a list of
+    # fragments and joined once, when its terminator finally arrives.
+
+    terminators = re.compile(r'\r\n|\n|\r')
+
+    def __init__(self):
+        self._fragments = []
+        self._after_cr = False
+
+    def __call__(self, output):
+        if self._after_cr and output.startswith('\n'):
+            output = output[1:]
+        if output:
+            self._after_cr = output.endswith('\r')
+        lines = type(self).terminators.split(output)
+        if len(lines) > 1:
+            self._fragments.append(lines[0])
+            lines[0] = ''.join(self._fragments)
+            self._fragments = []
+        tail = lines.pop()
+        if tail:
+            self._fragments.append(tail)
+        return lines
+
+
+class LineDispatcher(object):
+
+    # Classifies a line by its [level] tag and a single combined pattern of
+    # the start patterns of the parsers interested in that level, so lines
+    # that start nothing are rejected in one match.
+
+    def __init__(self, parser_classes):
+        self._patterns = {}
+        for level in set(l for c in parser_classes for l in c.levels):
+            candidates = [c for c in parser_classes if level in c.levels]
+            self._patterns[level] = (self._combine(candidates), candidates)
+
+    def classify(self, line):
+        for pattern, candidates in maybe(self._patterns.get(self._level(line))):
+            for m in maybe(pattern.match(line)):
+                return candidates[int(m.lastgroup[1:])]
+
+    def _level(self, line):
+        if line.startswith('['):
+            return line[1:line.find(']')]
+
+    def _combine(self, parser_classes):
+        return re.compile('|'.join('(?P<p%i>%s)' % (i, c.start_pattern.pattern)
+                                   for i, c in enumerate(parser_classes)))
 
 
 class OutputParser(object):
 
+    levels = ()
+
     def parse(self, line):
         self.finish()
 
 
 class AbstractErrorParser(OutputParser):
 
-    def __init__(self, project, line, filename, lineno, message):
+    def __init__(self, project, reporter, line, filename, lineno, message):
         self.project = project
-        self.reporter = project.error_reporter
+        self.reporter = reporter
         self.filename = filename
         self.lineno = lineno
         self.message = message
@@ -62,7 +312,7 @@ class AbstractErrorParser(OutputParser):
 
     def _error(self):
         return SbtError(project=self.project,
-                        filename=self.filename,
+                        filename=self.project.resolve_filename(self.filename) or self.filename,
                         line=self.lineno,
                         message=self.message,
                         error_type=self.error_type,
@@ -71,18 +321,23 @@ class AbstractErrorParser(OutputParser):
 
 class ErrorParser(AbstractErrorParser):
 
+    levels = ('error', 'warn')
+    start_pattern = re.compile(r'\[(error|warn)\]\s+(.+?):(\d+):(?:(\d+):)?\s+(.+)$')
+    last_line_pattern = re.compile(r'\[(?:error|warn)\] (\s*\^\s*)$')
+    line_pattern = re.compile(r'\[(?:error|warn)\] (.*)$')
+
     @classmethod
-    def start(cls, project, line):
-        for m in maybe(re.match(r'^\[(error|warn)\]\s+(.+?):(\d+):(?:(\d+):)?\s+(.+)$', line)):
-            yield cls(project,
+    def start(cls, project, reporter, line):
+        for m in maybe(cls.start_pattern.match(line)):
+            yield cls(project, reporter,
                       line=line,
                       label=m.group(1),
                       filename=m.group(2),
                       lineno=int(m.group(3)),
                       message=m.group(5))
 
-    def __init__(self, project, line, label, filename, lineno, message):
-        AbstractErrorParser.__init__(self, project, line, filename, lineno, message)
+    def __init__(self, project, reporter, line, label, filename, lineno, message):
+        AbstractErrorParser.__init__(self, project, reporter, line, filename, lineno, message)
         if label == 'warn':
             self.error_type = 'warning'
         else:
@@ -98,11 +353,11 @@ class ErrorParser(AbstractErrorParser):
         return self.finish()
 
     def _match_last_line(self, line):
-        for m in maybe(re.match(r'\[(?:error|warn)\] (\s*\^\s*)$', line)):
+        for m in maybe(type(self).last_line_pattern.match(line)):
             return m.group(1)
 
     def _match_line(self, line):
-        for m in maybe(re.match(r'\[(?:error|warn)\] (.*)$', line)):
+        for m in maybe(type(self).line_pattern.match(line)):
             return m.group(1)
 
 
@@ -111,17 +366,20 @@ class TestFailureParser(AbstractErrorParser):
     # Single line failures of the form:
     # [error|info] ... (filename::nn)
 
+    levels = ('error', 'info')
+    start_pattern = re.compile(r'\[(?:error|info)\]\s+(.+)\s+\(([^:]+):(\d+)\)$')
+
     @classmethod
-    def start(cls, project, line):
-        for m in maybe(re.match(r'\[(?:error|info)\]\s+(.+)\s+\(([^:]+):(\d+)\)$', line)):
-            yield cls(project,
+    def start(cls, project, reporter, line):
+        for m in maybe(cls.start_pattern.match(line)):
+            yield cls(project, reporter,
                       line=line,
                       filename=m.group(2),
                       lineno=int(m.group(3)),
                       message=m.group(1))
 
-    def __init__(self, project, line, filename, lineno, message):
-        AbstractErrorParser.__init__(self, project, line, filename, lineno, message)
+    def __init__(self, project, reporter, line, filename, lineno, message):
+        AbstractErrorParser.__init__(self, project, reporter, line, filename, lineno, message)
         self.error_type = 'failure'
 
 
@@ -132,15 +390,20 @@ class MultilineTestFailureParser(AbstractErrorParser):
     # [info] ...
     # [info] ... (filename:nn)
 
+    levels = ('info',)
+    start_pattern = re.compile(r'\[info\] - (.+) \*\*\* FAILED \*\*\*$')
+    last_line_pattern = re.compile(r'\[info\] (.+) \(([^:]+):(\d+)\)$')
+    line_pattern = re.compile(r'\[info\] (.*)$')
+
     @classmethod
-    def start(cls, project, line):
-        for m in maybe(re.match(r'\[info\] - (.+) \*\*\* FAILED \*\*\*$', line)):
-            yield cls(project,
+    def start(cls, project, reporter, line):
+        for m in maybe(cls.start_pattern.match(line)):
+            yield cls(project, reporter,
                       line=line,
                       message=m.group(1))
 
-    def __init__(self, project, line, message):
-        AbstractErrorParser.__init__(self, project, line, "dummy", 0, message)
+    def __init__(self, project, reporter, line, message):
+        AbstractErrorParser.__init__(self, project, reporter, line, "dummy", 0, message)
         self.error_type = 'error'
 
     def parse(self, line):
@@ -155,23 +418,27 @@ class MultilineTestFailureParser(AbstractErrorParser):
         return self.finish()
 
     def _match_last_line(self, line):
-        for m in maybe(re.match(r'\[info\] (.+) \(([^:]+):(\d+)\)$', line)):
+        for m in maybe(type(self).last_line_pattern.match(line)):
             return (m.group(1), m.group(2), int(m.group(3)))
 
     def _match_line(self, line):
-        for m in maybe(re.match(r'\[info\] (.*)$', line)):
+        for m in maybe(type(self).line_pattern.match(line)):
             return m.group(1)
 
 
 class FinishedParser(OutputParser):
 
+    levels = ('success', 'error')
+    start_pattern = re.compile(r'\[(success|error)\] Total time:(?: (\d+) s)?')
+
     @classmethod
-    def start(cls, project, line):
-        if re.match(r'\[(?:success|error)\] Total time:', line):
-            yield cls(project)
+    def start(cls, project, reporter, line):
+        for m in maybe(cls.start_pattern.match(line)):
+            yield cls(project, reporter, m.group(2), m.group(1) == 'success')
 
-    def __init__(self, project):
-        self.reporter = project.error_reporter
+    def __init__(self, project, reporter, total_time, success):
+        self.reporter = reporter
+        self.reporter.finished(total_time and int(total_time), success)
 
     def finish(self):
         self.reporter.finish()
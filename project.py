@@ -1,18 +1,26 @@
 import sublime
 
 try:
+    from .buildlog import BuildLog
     from .sbtsettings import SBTSettings
     from .errorreport import ErrorReport
     from .errorreporter import ErrorReporter
+    from .fileindex import FileIndex
+    from .timings import CommandTimings
     from .util import maybe, OnePerWindow
 except(ValueError):
+    from buildlog import BuildLog
     from sbtsettings import SBTSettings
     from errorreport import ErrorReport
     from errorreporter import ErrorReporter
+    from fileindex import FileIndex
+    from timings import CommandTimings
     from util import maybe, OnePerWindow
 
+import hashlib
 import os
 import re
+import time
 from glob import glob
 
 
@@ -25,19 +33,25 @@ class Project(OnePerWindow):
         self.error_reporter = ErrorReporter(window,
                                             self.error_report,
                                             self.settings)
+        self.command_timings = CommandTimings(self)
+        self.build_log = BuildLog(self)
+        self._file_index = None
+        self._description = None
+
+    def dispose(self):
+        self.error_report.clear()
+        self.build_log.close()
+        self._file_index = None
 
     def project_root(self):
-        for folder in self.window.folders():
-            if self._is_sbt_folder(folder):
-                return folder
+        return self._describe().root
 
     def is_sbt_project(self):
         return self.project_root() is not None
 
     def is_play_project(self):
-        for root in maybe(self.project_root()):
-            if self._play_build_files(root):
-                return True
+        if self._describe().is_play:
+            return True
 
     def sbt_command(self):
         if self.is_play_project():
@@ -54,6 +68,35 @@ class Project(OnePerWindow):
         else:
             return self._find_in_project(filename)
 
+    def resolve_filename(self, filename):
+        # For parser threads, which mustn't touch the window: resolves a bare
+        # filename through the index made on the main thread when sbt was
+        # started, waiting for it to refresh if need be.
+        if len(os.path.dirname(filename)) > 0:
+            return filename
+        for index in maybe(self._file_index):
+            return index.resolve(filename)
+
+    def file_index(self):
+        for root in maybe(self.project_root()):
+            if self._file_index is None or self._file_index.root != root:
+                self._file_index = FileIndex(root)
+            return self._file_index
+
+    def data_path(self, name):
+        for root in maybe(self.project_root()):
+            return os.path.join(root, 'target', 'sublimesbt', name)
+
+    # Data that must outlive `sbt clean` is kept in Sublime Text's cache
+    # directory, under a hash of the project root. Sublime Text 2 has no
+    # cache directory, so there it's kept with the other data files.
+    def cache_path(self, name):
+        if not hasattr(sublime, 'cache_path'):
+            return self.data_path(name)
+        for root in maybe(self.project_root()):
+            key = hashlib.md5(root.encode('utf-8')).hexdigest()
+            return os.path.join(sublime.cache_path(), 'SublimeSBT', 'projects', key, name)
+
     def relative_path(self, filename):
         return os.path.relpath(filename, self.project_root())
 
@@ -62,9 +105,19 @@ class Project(OnePerWindow):
         self.window.open_file('%s:%i' % (full_path, line),
                               sublime.ENCODED_POSITION)
 
-    def _is_sbt_folder(self, folder):
-        if self._sbt_build_files(folder) or self._scala_build_files(folder):
-            return True
+    def _describe(self):
+        folders = self.window.folders()
+        if self._description is None or not self._description.is_valid_for(folders):
+            self._description = self._create_description(folders)
+        return self._description
+
+    def _create_description(self, folders):
+        for folder in folders:
+            build_files = self._sbt_build_files(folder) + self._scala_build_files(folder)
+            if build_files:
+                return ProjectDescription(folders, folder, build_files,
+                                          bool(self._play_build_files(folder)))
+        return ProjectDescription(folders, None, [], False)
 
     def _sbt_build_files(self, folder):
         return glob(os.path.join(folder, '*.sbt'))
@@ -85,6 +138,44 @@ class Project(OnePerWindow):
             return False
 
     def _find_in_project(self, filename):
-        for path, _, files in os.walk(self.project_root()):
-            if filename in files:
-                return os.path.join(path, filename)
+        for index in maybe(self.file_index()):
+            return index.find(filename)
+
+
+class ProjectDescription(object):
+
+    # The project root, build files and Play flag of a window's folders. It
+    # stays valid while the folder list and the mtimes of the folders, their
+    # project directories and the build files are unchanged; the mtimes are
+    # checked at most once per check_interval.
+
+    check_interval = 1.0
+
+    def __init__(self, folders, root, build_files, is_play):
+        self.folders = folders
+        self.root = root
+        self.build_files = build_files
+        self.is_play = is_play
+        self._watched = (folders +
+                         [os.path.join(f, 'project') for f in folders] +
+                         build_files)
+        self._mtimes = self._stat_watched()
+        self._checked_at = time.time()
+
+    def is_valid_for(self, folders):
+        if folders != self.folders:
+            return False
+        if time.time() - self._checked_at >= type(self).check_interval:
+            if self._stat_watched() != self._mtimes:
+                return False
+            self._checked_at = time.time()
+        return True
+
+    def _stat_watched(self):
+        return [self._mtime(path) for path in self._watched]
+
+    def _mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
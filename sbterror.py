@@ -1,7 +1,7 @@
 try:
-    from .util import delayed
+    from .util import deferred
 except(ValueError):
-    from util import delayed
+    from util import deferred
 
 from threading import Event
 
@@ -9,9 +9,11 @@ import re
 
 class SbtError(object):
 
-    def __init__(self, project, filename, line, message, error_type, extra_lines):
+    def __init__(self, project, filename, line, message, error_type, extra_lines, column=None):
         self.line = int(line)
-        if len(extra_lines) > 0 and re.match(r' *^', extra_lines[-1]):
+        if column is not None:
+            self.column_spec = ':%i' % column
+        elif len(extra_lines) > 0 and re.match(r' *^', extra_lines[-1]):
             self.column_spec = ':%i' % len(extra_lines[-1])
         else:
             self.column_spec = ''
@@ -41,7 +43,7 @@ class SbtError(object):
     def encoded_position(self):
         return '%s:%i%s' % (self.filename, self.line, self.column_spec)
 
-    @delayed(0)
+    @deferred()
     def __finish(self, project, filename, extra_lines):
         try:
             self.__filename = project.expand_filename(filename)
@@ -1,21 +1,31 @@
 import sublime
 
 try:
+    from .ioloop import IOLoop
+    from .loginenv import LoginEnvironment
     from .project import Project
-    from .util import OnePerWindow
+    from .sbtserver import SbtServerConnection
+    from .util import maybe, FrameScheduler, OnePerWindow
 except(ValueError):
+    from ioloop import IOLoop
+    from loginenv import LoginEnvironment
     from project import Project
-    from util import OnePerWindow
+    from sbtserver import SbtServerConnection
+    from util import maybe, FrameScheduler, OnePerWindow
 
+import codecs
 import os
 import pipes
 import signal
 import subprocess
 import threading
+import time
 
 
 class SbtRunner(OnePerWindow):
 
+    _prewarmed_runners = set()
+
     @classmethod
     def is_sbt_running_for(cls, window):
         return cls(window).is_sbt_running()
@@ -23,8 +33,15 @@ class SbtRunner(OnePerWindow):
     def __init__(self, window):
         self._project = Project(window)
         self._proc = None
+        self._prewarm_attempted = False
+        self._last_used_at = None
         self.init_history()
 
+    def dispose(self):
+        type(self)._prewarmed_runners.discard(self)
+        self.stop_sbt()
+        self._history = []
+
     def project_root(self):
         return self._project.project_root()
 
@@ -36,11 +53,12 @@ class SbtRunner(OnePerWindow):
 
     def start_sbt(self, command, on_start, on_stop, on_stdout, on_stderr):
         if self.project_root() and not self.is_sbt_running():
-            self._proc = self._try_start_sbt_proc(self.sbt_command(command),
-                                                  on_start,
-                                                  on_stop,
-                                                  on_stdout,
-                                                  on_stderr)
+            self._project.file_index()
+            handlers = (on_start, on_stop, on_stdout, on_stderr)
+            self._proc = (self._try_attach_sbt_server(command, *handlers) or
+                          self._try_start_sbt_proc(self.sbt_command(command), *handlers))
+            if command is not None and self.is_sbt_running():
+                self._project.command_timings.sent(command)
 
     def stop_sbt(self):
         if self.is_sbt_running():
@@ -53,11 +71,53 @@ class SbtRunner(OnePerWindow):
     def is_sbt_running(self):
         return (self._proc is not None) and self._proc.is_running()
 
+    def is_attached_to_server(self):
+        return isinstance(self._proc, SbtServerConnection) and self._proc.is_running()
+
     def send_to_sbt(self, input):
         if self.is_sbt_running():
+            type(self)._prewarmed_runners.discard(self)
             self.add_to_history(input)
+            self._project.command_timings.sent(input)
             self._proc.send(input)
 
+    def prewarm_sbt(self, on_start, on_stop, on_stdout, on_stderr):
+        if not self._prewarm_attempted and self._can_prewarm():
+            self._prewarm_attempted = True
+            self.start_sbt(None, on_start, on_stop, on_stdout, on_stderr)
+            if self.is_sbt_running():
+                type(self)._prewarmed_runners.add(self)
+                self._last_used_at = time.time()
+                for command in maybe(self._project.settings.get('prewarm_command')):
+                    self._project.command_timings.sent(command)
+                    self._proc.send(command + '\n')
+                self._schedule_idle_check()
+
+    def is_prewarmed(self):
+        return self in type(self)._prewarmed_runners and self.is_sbt_running()
+
+    def _can_prewarm(self):
+        running = [r for r in type(self)._prewarmed_runners if r.is_sbt_running()]
+        return len(running) < (self._project.settings.get_int('prewarm_max_jvms') or 1)
+
+    def _schedule_idle_check(self):
+        timeout = self._project.settings.get('prewarm_idle_timeout') or 0
+        if timeout > 0:
+            sublime.set_timeout(self._stop_if_idle, int(timeout * 1000))
+
+    def _stop_if_idle(self):
+        if self.is_prewarmed():
+            timeout = self._project.settings.get('prewarm_idle_timeout') or 0
+            if time.time() - self._last_used_at >= timeout:
+                type(self)._prewarmed_runners.discard(self)
+                self.stop_sbt()
+            else:
+                self._schedule_idle_check()
+
+    def _try_attach_sbt_server(self, command, *handlers):
+        if self._project.settings.get_bool('attach_to_sbt_server'):
+            return SbtServerConnection.attach(self._project, command, *handlers)
+
     def _try_start_sbt_proc(self, cmdline, *handlers):
         try:
             return SbtProcess.start(cmdline,
@@ -86,7 +146,7 @@ class SbtRunner(OnePerWindow):
             input = input.rstrip('\n\r')
             self._history = [cmd for cmd in self._history if cmd != input]
             self._history.insert (0, input)
-            history_length = self._project.settings.get('history_length') or 20
+            history_length = self._project.settings.get_int('history_length') or 20
             del self._history[history_length:]
 
     def clear_history(self):
@@ -119,9 +179,9 @@ class SbtProcess(object):
                           cwd=cwd)
 
     @classmethod
-    def _sbt_env(cls, settings):
-        return dict(list(os.environ.items()) +
-                    [cls._append_opts('SBT_OPTS', cls._sbt_opts(settings))])
+    def _sbt_env(cls, settings, base_env=os.environ):
+        return dict(list(base_env.items()) +
+                    [cls._append_opts(base_env, 'SBT_OPTS', cls._sbt_opts(settings))])
 
     @classmethod
     def _sbt_opts(cls, settings):
@@ -130,8 +190,8 @@ class SbtProcess(object):
         ]
 
     @classmethod
-    def _append_opts(cls, name, opts):
-        existing_opts = os.environ.get(name, None)
+    def _append_opts(cls, base_env, name, opts):
+        existing_opts = base_env.get(name, None)
         if existing_opts:
             opts = [existing_opts] + opts
         return [name, ' '.join(opts)]
@@ -140,6 +200,19 @@ class SbtProcess(object):
         self._proc = proc
         self._encoding = settings.get('encoding') or 'UTF-8'
         on_start()
+        self._watch(on_stop, on_stdout, on_stderr)
+
+    def is_running(self):
+        return self._proc.returncode is None
+
+    def exit_status(self):
+        return self._proc.returncode
+
+    def send(self, input):
+        self._proc.stdin.write(input.encode())
+        self._proc.stdin.flush()
+
+    def _watch(self, on_stop, on_stdout, on_stderr):
         if self._proc.stdout:
             self._start_thread(self._monitor_output,
                                (self._proc.stdout, on_stdout))
@@ -148,25 +221,28 @@ class SbtProcess(object):
                                (self._proc.stderr, on_stderr))
         self._start_thread(self._monitor_proc, (on_stop,))
 
-    def is_running(self):
-        return self._proc.returncode is None
+    def _output_decoder(self, handle_output):
+        decoder = codecs.getincrementaldecoder(self._encoding)('replace')
 
-    def send(self, input):
-        self._proc.stdin.write(input.encode())
-        self._proc.stdin.flush()
+        def handle_data(data):
+            output = decoder.decode(data, not data)
+            if output != "":
+                handle_output(output)
+
+        return handle_data
 
     def _monitor_output(self, pipe, handle_output):
+        handle_data = self._output_decoder(handle_output)
         while True:
-            output = os.read(pipe.fileno(), 2 ** 15).decode(self._encoding)
-            if output != "":
-                handle_output(output)
-            else:
+            data = os.read(pipe.fileno(), 2 ** 15)
+            handle_data(data)
+            if not data:
                 pipe.close()
                 return
 
     def _monitor_proc(self, handle_stop):
         self._proc.wait()
-        sublime.set_timeout(handle_stop, 0)
+        FrameScheduler.instance().schedule(handle_stop)
 
     def _start_thread(self, target, args):
         threading.Thread(target=target, args=args).start()
@@ -174,6 +250,23 @@ class SbtProcess(object):
 
 class SbtUnixProcess(SbtProcess):
 
+    @classmethod
+    def _start_proc(cls, cmdline, cwd, settings):
+        if settings.get('cache_login_environment'):
+            for env in maybe(LoginEnvironment.current()):
+                for executable in maybe(env.which(cmdline[0])):
+                    proc = subprocess.Popen([executable] + cmdline[1:],
+                                            preexec_fn=os.setpgrp,
+                                            env=cls._sbt_env(settings, env.variables),
+                                            stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE,
+                                            cwd=cwd)
+                    sublime.status_message('SBT: started without a login shell (saved %.1fs)'
+                                           % env.startup_time)
+                    return proc
+        return super(SbtUnixProcess, cls)._start_proc(cmdline, cwd, settings)
+
     @classmethod
     def _popen(cls, cmdline, **kwargs):
         return subprocess.Popen(cls._shell_cmdline(cmdline),
@@ -182,10 +275,17 @@ class SbtUnixProcess(SbtProcess):
 
     @classmethod
     def _shell_cmdline(cls, cmdline):
-        shell = os.environ.get('SHELL', '/bin/bash')
-        opts = '-ic' if shell.endswith('csh') else '-lic'
-        cmd = ' '.join(map(pipes.quote, cmdline))
-        return [shell, opts, cmd]
+        return LoginEnvironment.shell_cmdline(' '.join(map(pipes.quote, cmdline)))
+
+    def _watch(self, on_stop, on_stdout, on_stderr):
+        loop = IOLoop.instance()
+        pipes = []
+        for pipe, handle_output in [(self._proc.stdout, on_stdout),
+                                    (self._proc.stderr, on_stderr)]:
+            if pipe:
+                loop.add_reader(pipe, self._output_decoder(handle_output))
+                pipes.append(pipe)
+        loop.add_process(self._proc, pipes, lambda: FrameScheduler.instance().schedule(on_stop))
 
     def terminate(self):
         os.killpg(self._proc.pid, signal.SIGTERM)
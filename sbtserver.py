@@ -0,0 +1,229 @@
+try:
+    from .sbterror import SbtError
+    from .util import deferred, load_json, maybe, FrameScheduler
+except(ValueError):
+    from sbterror import SbtError
+    from util import deferred, load_json, maybe, FrameScheduler
+
+try:
+    from urllib.parse import urlparse
+    from urllib.request import url2pathname
+except ImportError:
+    from urlparse import urlparse
+    from urllib import url2pathname
+
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+
+class SbtServerConnection(object):
+
+    # A connection to an already running sbt 1.x server, found through the
+    # project's project/target/active.json. It stands in for an SbtProcess:
+    # typed commands are sent with sbt/exec and log notifications are turned
+    # back into [level] lines for the output handlers. Compile problems are
+    # taken from publishDiagnostics notifications rather than from the log.
+
+    log_levels = {1: 'error', 2: 'warn', 3: 'info', 4: 'debug'}
+
+    error_types = {1: 'error', 2: 'warning'}
+
+    @classmethod
+    def attach(cls, project, command, on_start, on_stop, on_stdout, on_stderr):
+        for active in maybe(load_json(cls.active_json_path(project.project_root()))):
+            for sock in maybe(cls._connect(active.get('uri') or '')):
+                return cls(project, sock, cls._token(active), command,
+                           on_start, on_stop, on_stdout, on_stderr)
+
+    @classmethod
+    def active_json_path(cls, project_root):
+        return os.path.join(project_root, 'project', 'target', 'active.json')
+
+    @classmethod
+    def _connect(cls, uri):
+        sock = None
+        try:
+            if uri.startswith('local://') and hasattr(socket, 'AF_UNIX'):
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(uri[len('local://'):])
+            elif uri.startswith('tcp://'):
+                host, port = uri[len('tcp://'):].rsplit(':', 1)
+                sock = socket.create_connection((host, int(port)))
+            return sock
+        except (socket.error, ValueError):
+            if sock is not None:
+                sock.close()
+
+    @classmethod
+    def _token(cls, active):
+        for path in maybe(active.get('tokenfilePath')):
+            for tokenfile in maybe(load_json(path)):
+                return tokenfile.get('token')
+
+    def __init__(self, project, sock, token, command, on_start, on_stop, on_stdout, on_stderr):
+        self._project = project
+        self._sock = sock
+        self._on_stop = on_stop
+        self._on_stdout = on_stdout
+        self._reader = JsonRpcReader()
+        self._write_lock = threading.Lock()
+        self._next_id = 0
+        self._pending = {}
+        self._detach_after = None
+        self._connected = True
+        on_start()
+        thread = threading.Thread(target=self._monitor_socket)
+        thread.daemon = True
+        thread.start()
+        options = {}
+        if token is not None:
+            options['token'] = token
+        self._request('initialize', {'initializationOptions': options})
+        if command is not None:
+            self._exec(command, detach=True)
+
+    def is_running(self):
+        return self._connected
+
+    def send(self, input):
+        if '\004' in input or '\032' in input:
+            return self.terminate()
+        for line in input.splitlines():
+            if line.strip():
+                self._exec(line.strip())
+
+    def terminate(self):
+        self._detach()
+
+    def kill(self):
+        self._detach()
+
+    def _exec(self, command_line, detach=False):
+        self._on_stdout('> %s\n' % command_line)
+        return self._request('sbt/exec', {'commandLine': command_line}, timed=True,
+                             detach=detach)
+
+    # The request's id is recorded before the request is written, since the
+    # reader thread may see the response before the write returns.
+    def _request(self, method, params, timed=False, detach=False):
+        with self._write_lock:
+            self._next_id += 1
+            if timed:
+                self._pending[self._next_id] = time.time()
+            if detach:
+                self._detach_after = self._next_id
+            self._write({'jsonrpc': '2.0', 'id': self._next_id,
+                         'method': method, 'params': params})
+            return self._next_id
+
+    def _write(self, message):
+        body = json.dumps(message).encode('utf-8')
+        header = ('Content-Length: %i\r\n\r\n' % len(body)).encode('ascii')
+        try:
+            self._sock.sendall(header + body)
+        except socket.error:
+            self._detach()
+
+    def _monitor_socket(self):
+        try:
+            while True:
+                data = self._sock.recv(2 ** 15)
+                if not data:
+                    break
+                for message in self._reader.feed(data):
+                    self._handle_message(message)
+        except socket.error:
+            pass
+        finally:
+            self._connected = False
+            self._sock.close()
+            FrameScheduler.instance().schedule(self._on_stop)
+
+    def _handle_message(self, message):
+        method = message.get('method')
+        if method in ('window/logMessage', 'build/logMessage'):
+            params = message.get('params') or {}
+            self._log(params.get('type'), params.get('message') or '')
+        elif method == 'textDocument/publishDiagnostics':
+            self._publish_diagnostics(message.get('params') or {})
+        elif 'id' in message and method is None:
+            self._handle_response(message)
+
+    def _handle_response(self, message):
+        started_at = self._pending.pop(message['id'], None)
+        if started_at is not None:
+            label = 'error' if 'error' in message else 'success'
+            self._on_stdout('[%s] Total time: %i s\n' % (label, time.time() - started_at))
+            if message['id'] == self._detach_after:
+                self._detach()
+
+    def _log(self, level, text):
+        label = type(self).log_levels.get(level, 'info')
+        self._on_stdout(''.join(['[%s] %s\n' % (label, l) for l in text.splitlines()]))
+
+    def _publish_diagnostics(self, params):
+        filename = url2pathname(urlparse(params.get('uri') or '').path)
+        if filename:
+            errors = []
+            for diagnostic in params.get('diagnostics') or []:
+                for error in maybe(self._diagnostic_error(filename, diagnostic)):
+                    errors.append(error)
+            self._replace_errors_in(filename, errors)
+
+    def _diagnostic_error(self, filename, diagnostic):
+        for error_type in maybe(type(self).error_types.get(diagnostic.get('severity', 1))):
+            start = (diagnostic.get('range') or {}).get('start') or {}
+            lines = (diagnostic.get('message') or '').splitlines() or ['']
+            return SbtError(project=self._project,
+                            filename=filename,
+                            line=start.get('line', 0) + 1,
+                            message=lines[0],
+                            error_type=error_type,
+                            extra_lines=lines[1:],
+                            column=start.get('character', 0) + 1)
+
+    @deferred(key=lambda self, filename, errors: (self, filename))
+    def _replace_errors_in(self, filename, errors):
+        self._project.error_reporter.replace_errors_in(filename, errors)
+
+    def _detach(self):
+        if self._connected:
+            self._connected = False
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class JsonRpcReader(object):
+
+    # Reassembles Content-Length framed JSON-RPC messages from socket reads.
+
+    content_length = re.compile(r'Content-Length:\s*(\d+)', re.IGNORECASE)
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer.extend(data)
+        messages = []
+        while True:
+            header_end = self._buffer.find(b'\r\n\r\n')
+            if header_end < 0:
+                break
+            body_start = header_end + 4
+            header = bytes(self._buffer[:header_end]).decode('ascii', 'replace')
+            for m in maybe(type(self).content_length.search(header)):
+                body_end = body_start + int(m.group(1))
+                if len(self._buffer) < body_end:
+                    return messages
+                messages.append(json.loads(bytes(self._buffer[body_start:body_end]).decode('utf-8')))
+                del self._buffer[:body_end]
+                break
+            else:
+                del self._buffer[:body_start]
+        return messages
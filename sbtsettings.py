@@ -1,23 +1,36 @@
 import sublime
 
 try:
-    from .util import maybe
+    from .util import maybe, OnePerWindow
 except(ValueError):
-    from util import maybe
+    from util import maybe, OnePerWindow
 
 
-class SBTSettings(object):
+class SBTSettings(OnePerWindow):
+
+    # Settings are read through a snapshot resolved for the window's active
+    # view, which is replaced when the plugin settings change, when another
+    # view is activated or when the active view's settings change, rather
+    # than looking up the view's settings on every read. The window's
+    # callbacks for changes to the plugin settings and to its views' settings
+    # are registered under a key of its own, so they can be cleared when the
+    # window is closed.
 
     def __init__(self, window):
         self.window = window
         self._plugin_settings = sublime.load_settings('SublimeSBT.sublime-settings')
+        self._snapshot = None
+        self._watched_views = {}
+        self._on_change = []
+        self._on_change_key = 'SublimeSBT.%i' % window.id()
         self._migrate_user_config()
+        self._plugin_settings.add_on_change(self._on_change_key, self._plugin_settings_changed)
 
     def sbt_command(self):
         return self.get('sbt_command')
 
     def play_command(self):
-        return self._view_settings().get('sbt_command', self._plugin_settings.get('play_command'))
+        return self._resolved().get('sbt_command', 'play_command')
 
     def test_command(self):
         return self.get('test_command')
@@ -46,15 +59,68 @@ class SBTSettings(object):
         }
 
     def get(self, name):
-        return self._view_settings().get(name, self._plugin_settings.get(name))
+        return self._resolved().get(name)
 
-    def add_on_change(self, on_change):
-        self._plugin_settings.add_on_change('SublimeSBT', on_change)
+    def get_bool(self, name):
+        return bool(self.get(name))
 
-    def _view_settings(self):
-        for view in maybe(self.window.active_view()):
-            return view.settings().get('SublimeSBT', {})
-        return {}
+    def get_int(self, name, default=0):
+        value = self.get(name)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return int(value)
+        return default
+
+    def add_on_change(self, on_change):
+        self._on_change.append(on_change)
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def dispose(self):
+        self._plugin_settings.clear_on_change(self._on_change_key)
+        for view in self._watched_views.values():
+            view.settings().clear_on_change(self._on_change_key)
+        self._watched_views = {}
+        self._on_change = []
+        self.invalidate()
+
+    def view_closed(self, view_id):
+        self._watched_views.pop(view_id, None)
+
+    def view_activated(self, view):
+        if self._snapshot is not None and self._snapshot.view_id != view.id():
+            self.invalidate()
+
+    def _resolved(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            view = self.window.active_view()
+            snapshot = self._snapshot = ResolvedSettings(view and view.id(),
+                                                         self._view_settings(view),
+                                                         self._plugin_settings)
+        return snapshot
+
+    def _plugin_settings_changed(self):
+        self.invalidate()
+        for on_change in self._on_change:
+            on_change()
+
+    def _view_settings(self, view):
+        if view is None:
+            return {}
+        if view.id() not in self._watched_views:
+            self._watched_views[view.id()] = view
+            view.settings().add_on_change(self._on_change_key,
+                                          self._view_settings_changed(view.id()))
+        return view.settings().get('SublimeSBT', {})
+
+    def _view_settings_changed(self, view_id):
+
+        def on_change():
+            if self._snapshot is not None and self._snapshot.view_id == view_id:
+                self.invalidate()
+
+        return on_change
 
     def _migrate_user_config(self):
         style = self._plugin_settings.get('mark_style', None)
@@ -70,3 +136,23 @@ class SBTSettings(object):
             self._plugin_settings.erase('mark_style')
             self._plugin_settings.erase('error_scope')
             sublime.save_settings('SublimeSBT.sublime-settings')
+
+
+class ResolvedSettings(object):
+
+    # The settings for one view: its SublimeSBT settings over the plugin's.
+    # Each setting is looked up once and remembered, so the snapshot must be
+    # replaced rather than updated when either changes.
+
+    def __init__(self, view_id, view_settings, plugin_settings):
+        self.view_id = view_id
+        self._view_settings = dict(view_settings)
+        self._plugin_settings = plugin_settings
+        self._values = {}
+
+    def get(self, name, plugin_name=None):
+        key = (name, plugin_name)
+        if key not in self._values:
+            self._values[key] = self._view_settings.get(
+                name, self._plugin_settings.get(plugin_name or name))
+        return self._values[key]
@@ -8,11 +8,23 @@ except(ValueError):
     from sbtsettings import SBTSettings
     from util import maybe, OnePerWindow
 
-import re
-
 
 class SbtView(OnePerWindow):
 
+    # Output is buffered and appended to the panel in one edit at most every
+    # flush_interval milliseconds. While the view is quiet (sbt was started
+    # in the background and the panel hasn't been shown) or the panel has
+    # been hidden, output is only buffered, and the panel isn't touched until
+    # it's shown again. As the panel can be shown from Sublime Text's panel
+    # switcher without the plugin knowing, held output is flushed when the
+    # panel is activated and is checked for every hidden_poll_interval
+    # milliseconds. The panel and the buffer are kept to the
+    # scrollback_lines setting by removing the oldest lines once they're a
+    # tenth over, so trimming happens once in many flushes.
+
+    flush_interval = 50
+    hidden_poll_interval = 500
+
     settings = {
         "line_numbers": False,
         "gutter": False,
@@ -39,11 +51,22 @@ class SbtView(OnePerWindow):
         self._update_panel_colors()
         self.settings.add_on_change(self._update_panel_colors)
         self._output_size = 0
+        self._pending_output = []
+        self._pending_lines = 0
+        self._flush_scheduled = False
+        self._quiet = False
         self._set_running(False)
 
-    def start(self):
+    def dispose(self):
+        self._clear_pending_output()
+        self._quiet = True
+
+    def start(self, quiet=False):
         self.clear_output()
-        self.show()
+        if quiet:
+            self._quiet = True
+        else:
+            self.show()
         self._set_running(True)
 
     def finish(self):
@@ -51,9 +74,14 @@ class SbtView(OnePerWindow):
         self._set_running(False)
 
     def show(self):
+        self._quiet = False
         self._update_panel_colors()
         self.window.run_command('show_panel', {'panel': 'output.sbt'})
         sublime.set_timeout(self._show_selection, 0)
+        self._schedule_flush()
+
+    def activated(self):
+        self._flush_output()
 
     def hide(self):
         self.window.run_command('hide_panel', {'panel': 'output.sbt'})
@@ -63,15 +91,13 @@ class SbtView(OnePerWindow):
         self.panel.show(self.panel.size())
 
     def show_output(self, output):
-        output = self._clean_output(output)
-        self.show()
-        self._append_output(output)
-        self._output_size = self.panel.size()
-        self.panel.show(self._output_size)
-        self.panel.sel().clear()
-        self.panel.sel().add(sublime.Region(self._output_size, self._output_size))
+        self._pending_output.append(output)
+        self._pending_lines += output.count('\n')
+        self._trim_pending_output()
+        self._schedule_flush()
 
     def clear_output(self):
+        self._clear_pending_output()
         self._erase_output(sublime.Region(0, self.panel.size()))
 
     def take_input(self):
@@ -110,12 +136,57 @@ class SbtView(OnePerWindow):
         self.panel.set_read_only(not self._running or
                                  self.panel.sel()[0].begin() < self._output_size)
 
+    def _schedule_flush(self, delay=None):
+        if self._pending_output and not self._quiet and not self._flush_scheduled:
+            self._flush_scheduled = True
+            sublime.set_timeout(self._flush_output, delay or self.flush_interval)
+
+    def _flush_output(self):
+        self._flush_scheduled = False
+        if self._is_hidden():
+            self._schedule_flush(self.hidden_poll_interval)
+        elif self._pending_output and not self._quiet:
+            output = ''.join(self._pending_output)
+            self._clear_pending_output()
+            self._append_output(*self._collapse_overwrites(output))
+            self._output_size = self.panel.size()
+            self._trim_scrollback()
+            self.panel.show(self._output_size)
+            self.panel.sel().clear()
+            self.panel.sel().add(sublime.Region(self._output_size, self._output_size))
+
+    def _is_hidden(self):
+        return (hasattr(self.window, 'active_panel') and
+                self.window.active_panel() != 'output.sbt')
+
+    def _clear_pending_output(self):
+        self._pending_output = []
+        self._pending_lines = 0
+
+    # The first line is kept whole, since it may continue or overwrite the
+    # panel's last line.
+    def _trim_pending_output(self):
+        limit = self.settings.get_int('scrollback_lines')
+        if limit > 0 and self._pending_lines > limit + limit // 10:
+            lines = ''.join(self._pending_output).split('\n')
+            self._pending_output = ['\n'.join([lines[0]] + lines[-(limit + 1):])]
+            self._pending_lines = limit + 1
+
+    def _trim_scrollback(self):
+        limit = self.settings.get_int('scrollback_lines')
+        if limit > 0:
+            lines, _ = self.panel.rowcol(self._output_size)
+            if lines > limit + limit // 10:
+                trimmed = self.panel.text_point(lines - limit, 0)
+                self._erase_output(sublime.Region(0, trimmed))
+                self._output_size -= trimmed
+
     def _set_running(self, running):
         self._running = running
         self.update_writability()
 
-    def _append_output(self, output):
-        self._run_command('sbt_append_output', output=output)
+    def _append_output(self, output, overwrite_line=False):
+        self._run_command('sbt_append_output', output=output, overwrite_line=overwrite_line)
 
     def _erase_output(self, *regions):
         self._run_command('sbt_erase_output',
@@ -126,30 +197,29 @@ class SbtView(OnePerWindow):
         self.panel.run_command(name, kwargs)
         self.update_writability()
 
-    def _clean_output(self, output):
-        return self._strip_codes(self._normalize_lines(output))
-
-    def _normalize_lines(self, output):
-        return output.replace('\r\n', '\n').replace('\033M', '\r')
+    # A CR returns to the start of the line, so only what follows the last CR
+    # in each line is ever seen. Progress spinners send hundreds of these, so
+    # they're collapsed before rendering, leaving at most one overwrite of
+    # the panel's last line per flush.
+    def _collapse_overwrites(self, output):
+        lines = output.split('\n')
+        overwrite_line = '\r' in lines[0]
+        return '\n'.join([l[l.rfind('\r') + 1:] for l in lines]), overwrite_line
 
     def _show_selection(self):
         self.panel.show(self.panel.sel()[0].begin(), True)
 
-    def _strip_codes(self, output):
-        return re.sub(r'\033\[[0-9;]+[mK]', '', output)
-
     def _update_panel_colors(self):
         self.panel.settings().set('color_scheme', self.settings.get('color_scheme'))
 
 
 class SbtAppendOutputCommand(sublime_plugin.TextCommand):
 
-    def run(self, edit, output):
-        for i, s in enumerate(output.split('\r')):
-            if i > 0:
-                self.view.replace(edit, self.view.line(self.view.size()), s)
-            else:
-                self.view.insert(edit, self.view.size(), s)
+    def run(self, edit, output, overwrite_line=False):
+        if overwrite_line:
+            self.view.replace(edit, self.view.line(self.view.size()), output)
+        else:
+            self.view.insert(edit, self.view.size(), output)
 
 
 class SbtEraseOutputCommand(sublime_plugin.TextCommand):
@@ -2,21 +2,30 @@ import sublime_plugin
 import sublime
 
 import re
+import threading
 
 try:
     from .project import Project
     from .sbtrunner import SbtRunner
+    from .sbtsettings import SBTSettings
     from .sbtview import SbtView
     from .errorview import ErrorView
-    from .outputmon import BuildOutputMonitor
-    from .util import delayed, maybe
+    from .outputmon import BuildOutputMonitor, OutputNormalizer, OutputParserWorker
+    from .testshards import TestShardRunner
+    from .ioloop import IOLoop
+    from .util import (approximate_size, deferred, evict_closed_windows, evict_windows, maybe,
+                       FrameScheduler, MetaOnePerWindow, OnePerWindow)
 except(ValueError):
     from project import Project
     from sbtrunner import SbtRunner
+    from sbtsettings import SBTSettings
     from sbtview import SbtView
     from errorview import ErrorView
-    from outputmon import BuildOutputMonitor
-    from util import delayed, maybe
+    from outputmon import BuildOutputMonitor, OutputNormalizer, OutputParserWorker
+    from testshards import TestShardRunner
+    from ioloop import IOLoop
+    from util import (approximate_size, deferred, evict_closed_windows, evict_windows, maybe,
+                      FrameScheduler, MetaOnePerWindow, OnePerWindow)
 
 class SbtWindowCommand(sublime_plugin.WindowCommand):
 
@@ -28,7 +37,11 @@ class SbtWindowCommand(sublime_plugin.WindowCommand):
         self._error_view = ErrorView(self.window)
         self._error_reporter = self._project.error_reporter
         self._error_report = self._project.error_report
-        self._monitor_compile_output = BuildOutputMonitor(self._project)
+        self._monitor_compile_output = OutputParserWorker(
+            BuildOutputMonitor(self._project, timings=self._project.command_timings,
+                               server_diagnostics=self._runner.is_attached_to_server))
+        self._normalize_stdout = OutputNormalizer()
+        self._normalize_stderr = OutputNormalizer()
 
     def is_sbt_project(self):
         return self._project.is_sbt_project()
@@ -41,11 +54,17 @@ class SbtWindowCommand(sublime_plugin.WindowCommand):
 
     def start_sbt(self, command=None):
         self._runner.start_sbt(command,
-                               on_start=self._sbt_view.start,
-                               on_stop=self._sbt_view.finish,
+                               on_start=self._on_start,
+                               on_stop=self._on_stop,
                                on_stdout=self._on_stdout,
                                on_stderr=self._on_stderr)
 
+    def prewarm_sbt(self):
+        self._runner.prewarm_sbt(on_start=lambda: self._on_start(quiet=True),
+                                 on_stop=self._on_stop,
+                                 on_stdout=self._on_stdout,
+                                 on_stderr=self._on_stderr)
+
     def stop_sbt(self):
         self._runner.stop_sbt()
 
@@ -66,16 +85,17 @@ class SbtWindowCommand(sublime_plugin.WindowCommand):
 
     def send_to_sbt(self, cmd):
         self.window.run_command('clear_sbt_errors')
+        self.show_sbt()
         self._runner.send_to_sbt(cmd)
 
-    @delayed(0)
+    @deferred(key=lambda self, error: self)
     def show_error(self, error):
         self._error_report.focus_error(error)
         self._error_reporter.show_errors()
         self._error_view.show_error(error)
         self.goto_error(error)
 
-    @delayed(0)
+    @deferred(key=lambda self, error: self)
     def goto_error(self, error):
         self.window.open_file(error.encoded_position(), sublime.ENCODED_POSITION)
 
@@ -85,26 +105,29 @@ class SbtWindowCommand(sublime_plugin.WindowCommand):
     def setting(self, name):
         return self._project.setting(name)
 
+    def _on_start(self, quiet=False):
+        self._project.build_log.start()
+        self._sbt_view.start(quiet)
+
+    def _on_stop(self):
+        self._project.build_log.flush()
+        self._sbt_view.finish()
+
     def _on_stdout(self, output):
+        output = self._normalize_stdout(output)
+        self._project.build_log.write(output)
         self._monitor_compile_output(output)
         self._show_output(output)
 
     def _on_stderr(self, output):
+        output = self._normalize_stderr(output)
+        self._project.build_log.write(output)
         self._show_output(output)
 
-    @delayed(0)
+    @deferred()
     def _show_output(self, output):
-        output = self._work_around_JLine_bug(output)
         self._sbt_view.show_output(output)
 
-    # If we have a single character, space, CR then we are probably seeing a
-    # JLine bug which has inserted the space, CR at column 80 of a prompt
-    # line. Delete the space and CR so that it doesn't mess up the display
-    # of the prompt line (ie. hide the stuff before the CR). Just remove
-    # the space, CR pair.
-    def _work_around_JLine_bug(self, output):
-        return re.sub(r'^(.) \r$', r'\1', output)
-
 
 class StartSbtCommand(SbtWindowCommand):
 
@@ -115,6 +138,16 @@ class StartSbtCommand(SbtWindowCommand):
         return self.is_sbt_project() and not self.is_sbt_running()
 
 
+class PrewarmSbtCommand(SbtWindowCommand):
+
+    def run(self):
+        self.prewarm_sbt()
+
+    def is_enabled(self):
+        return (bool(self.setting('prewarm_sbt')) and
+                self.is_sbt_project() and not self.is_sbt_running())
+
+
 class StopSbtCommand(SbtWindowCommand):
 
     def run(self):
@@ -173,6 +206,24 @@ class SbtTestCommand(SbtCommand):
         return self.setting('test_command')
 
 
+class SbtShardedTestCommand(SbtWindowCommand):
+
+    def run(self):
+        TestShardRunner(self.window).start(self.setting('test_shards') or 1)
+
+    def is_enabled(self):
+        return self.is_sbt_project() and not TestShardRunner(self.window).is_running()
+
+
+class StopSbtShardedTestCommand(SbtWindowCommand):
+
+    def run(self):
+        TestShardRunner(self.window).stop()
+
+    def is_enabled(self):
+        return TestShardRunner(self.window).is_running()
+
+
 class SbtContinuousTestCommand(SbtTestCommand):
 
     def test_command(self):
@@ -339,6 +390,109 @@ class SbtClearHistoryCommand(SbtWindowCommand):
         self._runner.clear_history()
 
 
+class ShowSbtBuildLogCommand(SbtWindowCommand):
+
+    def run(self):
+        self.window.show_input_panel('Lines (e.g. 1000-2000, empty for all):', '',
+                                     self.show_lines, None, None)
+
+    def show_lines(self, line_range):
+        m = re.match(r'\s*(\d*)\s*(?:-\s*(\d*))?\s*$', line_range)
+        if m is None:
+            return sublime.error_message('"%s" is not a range of lines.' % line_range)
+        first = max(int(m.group(1) or 1), 1)
+        last = m.group(2) and int(m.group(2)) or None
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name(line_range.strip() and 'sbt.log (%s)' % line_range.strip() or 'sbt.log')
+        self._show_more_lines(view, self._project.build_log.lines(first, last))
+
+    # The log can be tens of megabytes, so it's added to the view a chunk at
+    # a time rather than read into a single string.
+    def _show_more_lines(self, view, lines):
+        chunk, size = [], 0
+        for line in lines:
+            chunk.append(line)
+            size += len(line)
+            if size >= 2 ** 16:
+                break
+        view.run_command('sbt_append_output', {'output': ''.join(chunk)})
+        if not chunk:
+            view.set_read_only(True)
+        elif view.window() is not None:
+            sublime.set_timeout(lambda: self._show_more_lines(view, lines), 0)
+
+    def is_enabled(self):
+        return self.is_sbt_project() and self._project.build_log.exists()
+
+
+class RescanSbtBuildLogCommand(SbtWindowCommand):
+
+    def run(self):
+        self._error_reporter.clear()
+        self._project.file_index()
+        worker = OutputParserWorker(BuildOutputMonitor(self._project))
+        thread = threading.Thread(target=self._rescan, args=(worker,))
+        thread.daemon = True
+        thread.start()
+
+    def _rescan(self, worker):
+        for chunk in self._project.build_log.chunks():
+            worker(chunk)
+        worker.after_parsing(self._error_reporter.finish)
+
+    def is_enabled(self):
+        return self.is_sbt_project() and self._project.build_log.exists()
+
+
+class ShowSbtCommandTimingsCommand(SbtWindowCommand):
+
+    def run(self):
+        summaries = self._project.command_timings.summary()
+        if summaries == []:
+            sublime.error_message('There are no SBT command timings to display.')
+        else:
+            self.window.show_quick_panel([s.list_item() for s in summaries], lambda index: None)
+
+    def is_enabled(self):
+        return self.is_sbt_project()
+
+
+class ShowSbtInstancesCommand(SbtWindowCommand):
+
+    def run(self):
+        open_ids = set(w.id() for w in sublime.windows())
+        rows = sorted((window_id, cls.__name__, instance)
+                      for cls in MetaOnePerWindow.classes
+                      for window_id, instance in cls.instances())
+        lines = ['%-8s %-8s %-16s %10s' % ('Window', 'State', 'Instance', 'Size')]
+        for window_id, name, instance in rows:
+            lines.append('%-8s %-8s %-16s %10s' % (
+                window_id,
+                window_id in open_ids and 'open' or 'closed',
+                name,
+                self._format_size(approximate_size(instance, OnePerWindow))))
+        for name, stats in [('IOLoop', IOLoop.instance().stats()),
+                            ('FrameScheduler', FrameScheduler.instance().stats())]:
+            lines.append('')
+            lines.append('%s: %s' % (name, ', '.join('%s %s' % (k, self._format_stat(v))
+                                                     for k, v in sorted(stats.items()))))
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name('SublimeSBT instances')
+        view.run_command('sbt_show_error_text', {'text': '\n'.join(lines) + '\n'})
+
+    def _format_size(self, size):
+        if size < 2 ** 20:
+            return '%.1f KB' % (size / 1024.0)
+        return '%.1f MB' % (size / 1048576.0)
+
+    def _format_stat(self, value):
+        if isinstance(value, float):
+            return '%.3f' % value
+        return value
+
+
 class SbtListener(sublime_plugin.EventListener):
 
     def on_clone(self, view):
@@ -364,9 +518,25 @@ class SbtListener(sublime_plugin.EventListener):
             for reporter in maybe(self._reporter(view)):
                 reporter.update_status_now()
 
+    def on_close(self, view):
+        for _, project in Project.instances():
+            project.error_reporter.view_closed(view.id())
+        for _, settings in SBTSettings.instances():
+            settings.view_closed(view.id())
+
+    def on_pre_close_window(self, window):
+        evict_windows([window.id()])
+
     def on_activated(self, view):
+        evict_closed_windows()
+        if SbtView.is_sbt_view(view):
+            SbtView(view.window()).activated()
+        for window in maybe(view.window()):
+            SBTSettings(window).view_activated(view)
         for reporter in maybe(self._reporter(view)):
             reporter.show_errors_in(view.file_name())
+        for window in maybe(view.window()):
+            window.run_command('prewarm_sbt')
 
     def on_query_context(self, view, key, operator, operand, match_all):
         if key == "in_sbt_view":
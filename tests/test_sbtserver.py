@@ -0,0 +1,211 @@
+"""Replays a recorded sbt server session through the diagnostics path, and
+attaches to a local server speaking the same framing.
+
+The fixture is the server's side of a session, as Content-Length framed
+JSON-RPC messages: the response to initialize, log notifications, diagnostics
+for two files, the failed sbt/exec response and a notification clearing one
+of the files. Run from the package's directory with:
+
+    python -m unittest discover tests
+"""
+
+import importlib
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+try:
+    import sublime
+except ImportError:
+    # Outside Sublime Text the plugin's modules only need timeouts, which
+    # are collected here and run by the test.
+    sublime = types.ModuleType('sublime')
+    sublime.timeouts = []
+    sublime.set_timeout = lambda f, delay=0: sublime.timeouts.append(f)
+    sys.modules['sublime'] = sublime
+
+sys.path.insert(0, os.path.dirname(root))
+sbtserver = importlib.import_module(os.path.basename(root) + '.sbtserver')
+
+
+class FakeProject(object):
+
+    def __init__(self):
+        self.error_reporter = self
+        self.replaced = []
+
+    def expand_filename(self, filename):
+        return filename
+
+    def relative_path(self, filename):
+        return os.path.relpath(filename, '/work/demo')
+
+    def replace_errors_in(self, filename, errors):
+        self.replaced.append((filename, errors))
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.project = FakeProject()
+        self.output = []
+        self.connection = object.__new__(sbtserver.SbtServerConnection)
+        self.connection._project = self.project
+        self.connection._on_stdout = self.output.append
+        self.connection._pending = {2: 0}
+        self.connection._detach_after = None
+        self.connection._connected = True
+        with open(os.path.join(root, 'tests', 'fixtures', 'sbt_server_session.jsonrpc'),
+                  'rb') as f:
+            self.transcript = f.read()
+
+    def replay(self, chunk_size):
+        reader = sbtserver.JsonRpcReader()
+        messages = []
+        for i in range(0, len(self.transcript), chunk_size):
+            messages.extend(reader.feed(self.transcript[i:i + chunk_size]))
+        for message in messages:
+            self.connection._handle_message(message)
+            while sublime.timeouts:
+                sublime.timeouts.pop(0)()
+        return messages
+
+    def test_reassembles_every_message_from_any_split(self):
+        for chunk_size in (1, 7, 64, len(self.transcript)):
+            self.setUp()
+            self.assertEqual(len(self.replay(chunk_size)), 8)
+
+    def test_diagnostics_become_errors_with_exact_positions(self):
+        self.replay(4096)
+        main = '/work/demo/src/main/scala/demo/Main.scala'
+        util = '/work/demo/src/main/scala/demo/My Util.scala'
+        self.assertEqual([f for f, _ in self.project.replaced], [main, util, util])
+        errors = self.project.replaced[0][1]
+        self.assertEqual([(e.error_type, e.line, e.column_spec, e.message) for e in errors],
+                         [('error', 12, ':19', 'type mismatch;'),
+                          ('error', 21, ':5', 'not found: value prnt'),
+                          ('warning', 4, ':1', 'Unused import')])
+        self.assertEqual(errors[0].encoded_position(), main + ':12:19')
+        self.assertEqual(errors[0].text.splitlines(),
+                         ['src/main/scala/demo/Main.scala:12: type mismatch;',
+                          ' found   : String("three")',
+                          ' required: Int'])
+        warnings = self.project.replaced[1][1]
+        self.assertEqual([(e.error_type, e.line, e.column_spec) for e in warnings],
+                         [('warning', 1, ':8')])
+        self.assertEqual(self.project.replaced[2][1], [])
+
+    def test_log_and_response_become_output_lines(self):
+        self.replay(4096)
+        lines = ''.join(self.output).splitlines()
+        self.assertEqual(lines[:3], [
+            '[info] Processing sbt/exec compile',
+            '[info] compiling 2 Scala sources to /work/demo/target/scala-2.13/classes ...',
+            '[error] (Compile / compileIncremental) Compilation failed'])
+        self.assertTrue(lines[3].startswith('[error] Total time: '))
+
+
+class LocalServer(object):
+
+    # Accepts one connection, answers initialize, and answers each sbt/exec
+    # with a log notification and a successful response.
+
+    def __init__(self):
+        self.received = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(1)
+        self.port = self._sock.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self):
+        self._thread.join(5)
+        self._sock.close()
+
+    def _serve(self):
+        conn, _ = self._sock.accept()
+        reader = sbtserver.JsonRpcReader()
+        try:
+            while True:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                for message in reader.feed(data):
+                    self.received.append(message)
+                    if message['method'] == 'sbt/exec':
+                        self._send(conn, {'jsonrpc': '2.0', 'method': 'window/logMessage',
+                                          'params': {'type': 3, 'message': 'Done.'}})
+                    self._send(conn, {'jsonrpc': '2.0', 'id': message['id'], 'result': {}})
+        finally:
+            conn.close()
+
+    def _send(self, conn, message):
+        body = json.dumps(message).encode('utf-8')
+        conn.sendall(('Content-Length: %i\r\n\r\n' % len(body)).encode('ascii') + body)
+
+
+class AttachTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.project = FakeProject()
+        self.project.project_root = lambda: self.root
+        self.output = []
+        self.started = []
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_active_json(self, port):
+        os.makedirs(os.path.join(self.root, 'project', 'target'))
+        with open(sbtserver.SbtServerConnection.active_json_path(self.root), 'w') as f:
+            json.dump({'uri': 'tcp://127.0.0.1:%i' % port}, f)
+
+    def attach(self, command):
+        return sbtserver.SbtServerConnection.attach(
+            self.project, command,
+            on_start=lambda: self.started.append(True),
+            on_stop=lambda: None,
+            on_stdout=self.output.append,
+            on_stderr=self.output.append)
+
+    def test_runs_the_command_and_detaches_after_its_response(self):
+        server = LocalServer()
+        self.write_active_json(server.port)
+        connection = self.attach('compile')
+        self.assertTrue(connection is not None)
+        deadline = time.time() + 5
+        while connection.is_running() and time.time() < deadline:
+            time.sleep(0.01)
+        server.join()
+        self.assertFalse(connection.is_running())
+        self.assertEqual(self.started, [True])
+        self.assertEqual([m['method'] for m in server.received], ['initialize', 'sbt/exec'])
+        self.assertEqual(server.received[1]['params'], {'commandLine': 'compile'})
+        lines = ''.join(self.output).splitlines()
+        self.assertEqual(lines[:2], ['> compile', '[info] Done.'])
+        self.assertTrue(lines[2].startswith('[success] Total time: '))
+
+    def test_returns_none_when_the_connection_is_refused(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.write_active_json(port)
+        self.assertEqual(self.attach('compile'), None)
+        self.assertEqual(self.started, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,360 @@
+import sublime
+
+try:
+    from .outputmon import (BuildOutputMonitor, LineSplitter, OutputNormalizer,
+                            OutputParserWorker)
+    from .project import Project
+    from .sbtrunner import SbtProcess
+    from .util import load_json, maybe, OnePerWindow, save_json
+except(ValueError):
+    from outputmon import (BuildOutputMonitor, LineSplitter, OutputNormalizer,
+                           OutputParserWorker)
+    from project import Project
+    from sbtrunner import SbtProcess
+    from util import load_json, maybe, OnePerWindow, save_json
+
+import os
+import re
+import threading
+import time
+
+
+class TestShardRunner(OnePerWindow):
+
+    # Runs the test suite split across several batch sbt processes. Test
+    # classes are balanced across the shards by their durations in earlier
+    # runs, every shard's output is parsed by its own monitor into the
+    # window's error report, and progress is shown in the sbt_shards panel.
+
+    refresh_interval = 500
+
+    def __init__(self, window):
+        self.window = window
+        self._project = Project(window)
+        self._durations = TestDurations(self._project)
+        self._shards = []
+        self._compile = None
+        self._running = False
+        self._stopped = False
+        self._started_at = None
+        self._finished_at = None
+        self._serial_estimate = None
+        self._message = ''
+        self._panel = None
+
+    def dispose(self):
+        self.stop()
+        self._running = False
+        self._shards = []
+        self._panel = None
+
+    def is_running(self):
+        return self._running
+
+    def start(self, shard_count):
+        if not self._running and self._project.project_root():
+            self._running = True
+            self._stopped = False
+            self._shards = []
+            self._started_at = time.time()
+            self._finished_at = None
+            self._message = 'Discovering test classes...'
+            self._project.error_reporter.clear()
+            self._show_progress()
+            thread = threading.Thread(target=self._plan, args=(shard_count,))
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self._stopped = True
+        for proc in maybe(self._compile):
+            proc.terminate()
+        for shard in self._shards:
+            shard.stop()
+
+    def _plan(self, shard_count):
+        classes = TestDiscovery(self._project.project_root()).test_classes()
+        durations = self._durations.load()
+        plan = balance(classes, durations, shard_count)
+        sublime.set_timeout(lambda: self._start(plan, durations), 0)
+
+    def _start(self, plan, durations):
+        if self._stopped:
+            self._message = 'Stopped.'
+            return self._finish()
+        if not plan:
+            self._message = 'No test classes found.'
+            return self._finish()
+        self._serial_estimate = estimate(sum(plan, []), durations)
+        if self._project.setting('test_shards_compile_first'):
+            self._message = 'Compiling tests...'
+            monitor = OutputParserWorker(BuildOutputMonitor(self._project))
+            self._compile = self._start_proc(['test:compile'],
+                                             lambda: self._compiled(plan, monitor),
+                                             StreamLines(monitor),
+                                             StreamLines(monitor))
+            if self._compile is None:
+                self._finish()
+        else:
+            self._start_shards(plan)
+
+    def _compiled(self, plan, monitor):
+        proc, self._compile = self._compile, None
+        if self._stopped:
+            self._message = 'Stopped.'
+            monitor.after_parsing(self._finish)
+        elif proc.exit_status() == 0:
+            self._start_shards(plan)
+        else:
+            self._message = 'Compiling tests failed.'
+            monitor.after_parsing(self._finish)
+
+    def _start_shards(self, plan):
+        self._message = ''
+        for i, classes in enumerate(plan):
+            shard = TestShard(i + 1, classes, self._project)
+            shard.proc = self._start_proc(['testOnly %s' % ' '.join(classes)],
+                                          lambda shard=shard: self._shard_stopped(shard),
+                                          StreamLines(shard),
+                                          StreamLines(shard))
+            if shard.proc is None:
+                shard.finished_at = time.time()
+            self._shards.append(shard)
+        if all(s.proc is None for s in self._shards):
+            self._finish()
+        else:
+            self._refresh()
+
+    def _start_proc(self, commands, on_stop, on_stdout, on_stderr):
+        cmdline = self._project.sbt_command() + commands
+        try:
+            return SbtProcess.start(cmdline,
+                                    self._project.project_root(),
+                                    self._project.settings,
+                                    lambda: None,
+                                    on_stop,
+                                    on_stdout,
+                                    on_stderr)
+        except OSError:
+            self._message = 'Unable to find "%s".' % cmdline[0]
+
+    def _shard_stopped(self, shard):
+        shard.finished_at = time.time()
+        if all(s.finished_at is not None for s in self._shards):
+            parsed = [s for s in self._shards if s.proc is not None]
+            for s in parsed:
+                s.monitor.after_parsing(lambda s=s: self._shard_parsed(s, parsed))
+
+    def _shard_parsed(self, shard, parsed):
+        shard.parsed = True
+        if all(s.parsed for s in parsed):
+            self._project.error_reporter.finish()
+            if not self._stopped and all(s.passed() for s in self._shards):
+                self._durations.record(self._shards)
+            self._finish()
+
+    def _finish(self):
+        self._running = False
+        self._finished_at = time.time()
+        self._show_progress()
+
+    def _refresh(self):
+        self._show_progress()
+        if self._running:
+            sublime.set_timeout(self._refresh, self.refresh_interval)
+
+    def _show_progress(self):
+        if self._panel is None:
+            self._panel = self.window.get_output_panel('sbt_shards')
+            self._panel.set_read_only(True)
+            self._panel.settings().set('line_numbers', False)
+            self._panel.settings().set('gutter', False)
+        self._panel.run_command('sbt_show_error_text', {'text': self._progress_text()})
+        self.window.run_command('show_panel', {'panel': 'output.sbt_shards'})
+
+    def _progress_text(self):
+        lines = [' -- Sharded test run: %i shards --' % len(self._shards)]
+        if self._message:
+            lines.append(self._message)
+        for shard in self._shards:
+            lines.append(shard.progress())
+        if self._finished_at is not None and self._shards:
+            lines.append(self._comparison())
+        return '\n'.join(lines)
+
+    def _comparison(self):
+        wall = self._finished_at - self._started_at
+        serial = sum(s.elapsed() for s in self._shards)
+        text = 'Wall clock %s; sum of shard times %s' % (duration(wall), duration(serial))
+        for serial_estimate in maybe(self._serial_estimate):
+            text += '; estimated serial time %s (%.1fx)' % (duration(serial_estimate),
+                                                           serial_estimate / max(wall, 1))
+        return text
+
+
+class TestShard(object):
+
+    def __init__(self, number, classes, project):
+        self.number = number
+        self.classes = classes
+        self.proc = None
+        self.lines = 0
+        self.failures = 0
+        self.parsed = False
+        self.started_at = time.time()
+        self.finished_at = None
+        reporter = ShardReporter(self, project.error_reporter)
+        self.monitor = OutputParserWorker(BuildOutputMonitor(project, reporter))
+
+    def __call__(self, output):
+        self.lines += output.count('\n')
+        self.monitor(output)
+
+    def stop(self):
+        if self.proc is not None and self.proc.is_running():
+            self.proc.terminate()
+
+    def passed(self):
+        return self.proc is not None and self.proc.exit_status() == 0
+
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def progress(self):
+        if self.proc is None:
+            state = 'not started'
+        elif self.finished_at is None:
+            state = 'running'
+        elif self.passed():
+            state = 'passed'
+        else:
+            state = 'failed'
+        return ' Shard %i: %-11s %4i classes %8i lines %4i failures %s' % (
+            self.number, state, len(self.classes), self.lines, self.failures,
+            duration(self.elapsed()))
+
+
+class StreamLines(object):
+
+    # Normalizes one of a process's output streams and passes on only its
+    # complete lines, so that partial lines from stdout and stderr can't be
+    # interleaved when both are sent to the same consumer.
+
+    def __init__(self, consumer):
+        self._consumer = consumer
+        self._normalize = OutputNormalizer()
+        self._lines = LineSplitter()
+
+    def __call__(self, output):
+        lines = self._lines(self._normalize(output))
+        if lines:
+            self._consumer('\n'.join(lines) + '\n')
+
+
+class ShardReporter(object):
+
+    # Passes a shard's errors on to the window's reporter but leaves out the
+    # shard's own end of build, so the error report is only cycled once all
+    # of the shards are done.
+
+    def __init__(self, shard, error_reporter):
+        self._shard = shard
+        self._error_reporter = error_reporter
+
+    def error(self, error):
+        self.errors([error])
+
+    def errors(self, errors):
+        self._shard.failures += len([e for e in errors if e.error_type != 'warning'])
+        self._error_reporter.errors(errors)
+
+    def finish(self):
+        pass
+
+
+class TestDiscovery(object):
+
+    # Finds test classes by scanning the sources under src/test for classes
+    # and objects named like tests. Abstract classes aren't matched.
+
+    skip_dirs = frozenset(['target', '.git'])
+    source_extensions = ('.scala', '.java')
+    test_source_dir = os.path.join('src', 'test')
+    package_pattern = re.compile(r'^\s*package\s+(?!object\b)([\w.]+)', re.MULTILINE)
+    class_pattern = re.compile(r'^\s*(?:(?:public|final|case)\s+)*(?:class|object)\s+'
+                               r'(\w+(?:Spec|Specification|Suite|Test|Tests))\b',
+                               re.MULTILINE)
+
+    def __init__(self, root):
+        self.root = root
+
+    def test_classes(self):
+        classes = []
+        for path, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if d not in type(self).skip_dirs]
+            if type(self).test_source_dir in path:
+                for name in files:
+                    if name.endswith(type(self).source_extensions):
+                        classes.extend(self._classes_in(os.path.join(path, name)))
+        return sorted(set(classes))
+
+    def _classes_in(self, path):
+        try:
+            with open(path) as f:
+                source = f.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            return []
+        package = '.'.join(type(self).package_pattern.findall(source))
+        prefix = package + '.' if package else ''
+        return [prefix + name for name in type(self).class_pattern.findall(source)]
+
+
+class TestDurations(object):
+
+    # Per test class durations from earlier sharded runs, stored in the
+    # project's cache directory. A shard's elapsed time is shared out among
+    # its classes in proportion to their previous estimates.
+
+    def __init__(self, project):
+        self._project = project
+
+    def load(self):
+        return load_json(self._path()) or {}
+
+    def record(self, shards):
+        durations = self.load()
+        for shard in shards:
+            if shard.proc is not None and shard.proc.exit_status() is not None:
+                weights = [durations.get(c, 1.0) for c in shard.classes]
+                total = sum(weights)
+                for c, w in zip(shard.classes, weights):
+                    durations[c] = shard.elapsed() * w / total
+        save_json(self._path(), durations)
+
+    def _path(self):
+        return self._project.cache_path('test_durations.json')
+
+
+def balance(classes, durations, shard_count):
+    default = _median(list(durations.values())) or 1.0
+    shards = [[0.0, []] for _ in range(min(shard_count, len(classes)))]
+    for c in sorted(classes, key=lambda c: -durations.get(c, default)):
+        shard = min(shards, key=lambda s: s[0])
+        shard[0] += durations.get(c, default)
+        shard[1].append(c)
+    return [classes for _, classes in shards]
+
+
+def estimate(classes, durations):
+    if durations:
+        default = _median(list(durations.values()))
+        return sum(durations.get(c, default) for c in classes)
+
+
+def duration(seconds):
+    return '%im%02is' % divmod(int(seconds), 60)
+
+
+def _median(values):
+    if values:
+        return sorted(values)[len(values) // 2]
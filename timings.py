@@ -0,0 +1,159 @@
+try:
+    from .util import load_json, save_json
+except(ValueError):
+    from util import load_json, save_json
+
+import re
+import threading
+import time
+
+
+class CommandTimings(object):
+
+    # Records a timeline for each command sent to sbt - when it was sent,
+    # when its first output and first error arrived and when sbt reported
+    # its total time - and keeps the most recent samples for every command
+    # in the project's cache directory. A continuous (~) command starts
+    # a new timeline with the first output after each of its cycles other
+    # than sbt's banners saying that it's waiting for changes (sbt 0.13) or
+    # monitoring source files (sbt 1.3+). A command made of several commands
+    # separated by semicolons finishes with the total time of the last one,
+    # or of the first one to fail, as sbt stops there.
+
+    max_samples = 200
+
+    watch_banner = re.compile(r'(?:\[info\])?\s*(?:\d+\. )?(?:Waiting for source changes'
+                              r'|Monitoring source files for'
+                              r'|Press <enter> to interrupt)', re.IGNORECASE)
+
+    def __init__(self, project):
+        self._project = project
+        self._timeline = None
+        self._continuous = None
+        self._lock = threading.Lock()
+
+    def sent(self, command):
+        command = ' '.join(command.split())
+        if not command or '\004' in command or '\032' in command:
+            return
+        with self._lock:
+            self._timeline = CommandTimeline(command, time.time())
+            self._continuous = None
+
+    def output(self, output):
+        with self._lock:
+            if self._timeline is not None:
+                self._timeline.output()
+            elif self._continuous is not None and not self._is_watch_banner(output):
+                self._timeline = CommandTimeline(self._continuous, time.time())
+                self._timeline.output()
+
+    def error(self):
+        with self._lock:
+            if self._timeline is not None:
+                self._timeline.error()
+
+    def finished(self, total_time, success=True):
+        with self._lock:
+            timeline = self._timeline
+            if timeline is None or not timeline.finish(total_time, success):
+                return
+            self._timeline = None
+            if timeline.command.startswith('~'):
+                self._continuous = timeline.command
+            self._record(timeline)
+
+    def summary(self):
+        with self._lock:
+            samples = self._load()
+        return [CommandSummary(command, samples[command]) for command in sorted(samples)]
+
+    def _is_watch_banner(self, output):
+        lines = [l for l in output.splitlines() if l.strip()]
+        return all(type(self).watch_banner.match(l) for l in lines)
+
+    def _record(self, timeline):
+        samples = self._load()
+        command_samples = samples.setdefault(timeline.command, [])
+        command_samples.append(timeline.sample())
+        del command_samples[:-type(self).max_samples]
+        self._save(samples)
+
+    def _path(self):
+        return self._project.cache_path('command_timings.json')
+
+    def _load(self):
+        return load_json(self._path()) or {}
+
+    def _save(self, samples):
+        save_json(self._path(), samples)
+
+
+class CommandTimeline(object):
+
+    def __init__(self, command, sent_at):
+        self.command = command
+        self.sent_at = sent_at
+        self.first_output_at = None
+        self.first_error_at = None
+        self.finished_at = None
+        self.total_time = None
+        self._remaining = len([c for c in command.split(';') if c.strip()]) or 1
+
+    def output(self):
+        if self.first_output_at is None:
+            self.first_output_at = time.time()
+
+    def error(self):
+        if self.first_error_at is None:
+            self.first_error_at = time.time()
+
+    def finish(self, total_time, success=True):
+        self._remaining -= 1
+        if total_time is not None:
+            self.total_time = (self.total_time or 0) + total_time
+        if success and self._remaining > 0:
+            return False
+        self.finished_at = time.time()
+        return True
+
+    def sample(self):
+        return [self.finished_at - self.sent_at,
+                self._since_sent(self.first_output_at),
+                self._since_sent(self.first_error_at),
+                self.total_time]
+
+    def _since_sent(self, t):
+        if t is not None:
+            return t - self.sent_at
+
+
+class CommandSummary(object):
+
+    def __init__(self, command, samples):
+        self.command = command
+        self.count = len(samples)
+        self.latency = [s[0] for s in samples]
+        self.first_output = [s[1] for s in samples if s[1] is not None]
+        self.total_time = [s[3] for s in samples if s[3] is not None]
+
+    def list_item(self):
+        return [self.command,
+                'p50 %s  p95 %s  (%i runs)' % (seconds(percentile(self.latency, 50)),
+                                              seconds(percentile(self.latency, 95)),
+                                              self.count),
+                'first output p50 %s  sbt total time p50 %s' % (
+                    seconds(percentile(self.first_output, 50)),
+                    seconds(percentile(self.total_time, 50)))]
+
+
+def percentile(values, p):
+    if values:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def seconds(value):
+    if value is None:
+        return '-'
+    return '%.1fs' % value
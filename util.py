@@ -2,7 +2,13 @@ import sublime
 
 import functools
 import itertools
+import json
+import os
+import sys
 import threading
+import time
+import traceback
+import types
 
 
 def maybe(value):
@@ -10,6 +16,38 @@ def maybe(value):
         yield value
 
 
+def load_json(path):
+    if path is not None:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            pass
+
+
+# Writes data to the file at path, creating its directory if need be. With a
+# mode, the file is created with that mode and an existing file is reset to
+# it.
+def save_json(path, data, mode=None):
+    if path is not None:
+        try:
+            make_parent_dirs(path)
+            if mode is None:
+                f = open(path, 'w')
+            else:
+                f = os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), 'w')
+                os.chmod(path, mode)
+            with f:
+                json.dump(data, f)
+        except (IOError, OSError):
+            pass
+
+
+def make_parent_dirs(path):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+
 def group_by(xs, kf):
     grouped = {}
     for k, i in itertools.groupby(xs, kf):
@@ -17,18 +55,102 @@ def group_by(xs, kf):
     return grouped
 
 
-class delayed(object):
+class deferred(object):
 
-    def __init__(self, timeout):
-        self.timeout = timeout
+    # Defers calls to the next frame of the FrameScheduler. With a key
+    # function, which is passed the same arguments as the call, a call
+    # replaces any call of the same function with the same key that hasn't
+    # run yet.
+
+    def __init__(self, key=None):
+        self.key = key
 
     def __call__(self, f):
 
-        def call_with_timeout(*args, **kwargs):
-            sublime.set_timeout(functools.partial(f, *args, **kwargs),
-                                self.timeout)
+        def call_on_next_frame(*args, **kwargs):
+            key = None
+            if self.key is not None:
+                key = (f, self.key(*args, **kwargs))
+            FrameScheduler.instance().schedule(functools.partial(f, *args, **kwargs), key)
+
+        return call_on_next_frame
+
+
+class FrameScheduler(object):
+
+    # Runs UI work on the main thread in frames at a fixed rate, rather than
+    # as a timeout per call, so a noisy build can't flood the main thread
+    # with thousands of tiny callbacks. Work runs in the order it was
+    # scheduled. Work scheduled under a key replaces any work under the same
+    # key that hasn't run yet and moves to the back of the queue, so repeated
+    # requests for the same repaint run once, after whatever they followed.
 
-        return call_with_timeout
+    frame_interval = 16
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self._pending = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._frame_scheduled = False
+        self.ticks = 0
+        self.dropped = 0
+        self.last_depth = 0
+        self.max_depth = 0
+        self.busy_time = 0.0
+        self.max_tick_time = 0.0
+
+    def schedule(self, f, key=None):
+        with self._lock:
+            self._seq += 1
+            if key is None:
+                key = (None, self._seq)
+            elif key in self._pending:
+                self.dropped += 1
+            self._pending[key] = (self._seq, f)
+            if not self._frame_scheduled:
+                self._frame_scheduled = True
+                sublime.set_timeout(self._tick, self.frame_interval)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'ticks': self.ticks,
+                'dropped': self.dropped,
+                'last_depth': self.last_depth,
+                'max_depth': self.max_depth,
+                'busy_time': self.busy_time,
+                'max_tick_time': self.max_tick_time
+            }
+
+    def _tick(self):
+        with self._lock:
+            pending = sorted(self._pending.values())
+            self._pending = {}
+            self._frame_scheduled = False
+        started_at = time.time()
+        for _, f in pending:
+            try:
+                f()
+            except Exception:
+                traceback.print_exc()
+        elapsed = time.time() - started_at
+        with self._lock:
+            self.ticks += 1
+            self.last_depth = len(pending)
+            self.max_depth = max(self.max_depth, len(pending))
+            self.busy_time += elapsed
+            self.max_tick_time = max(self.max_tick_time, elapsed)
 
 
 class SynchronizedCache(object):
@@ -43,15 +165,84 @@ class SynchronizedCache(object):
                 self.__items[key] = f()
             return self.__items[key]
 
+    def evict(self, key):
+        with self.__lock:
+            return self.__items.pop(key, None)
+
+    def items(self):
+        with self.__lock:
+            return list(self.__items.items())
+
 
 class MetaOnePerWindow(type):
 
+    # Every class made with this metaclass is registered in `classes`, so the
+    # instances of a window that has closed can be found and evicted. An
+    # evicted instance is sent dispose() to let go of its processes, panels
+    # and anything else that would otherwise live as long as the plugin.
+
+    classes = []
+
     def __init__(cls, name, bases, dct):
         super(MetaOnePerWindow, cls).__init__(name, bases, dct)
         cls.instance_cache = SynchronizedCache()
+        MetaOnePerWindow.classes.append(cls)
 
     def __call__(cls, window):
         return cls.instance_cache(window.id(), lambda: type.__call__(cls, window))
 
-
-OnePerWindow = MetaOnePerWindow('OnePerWindow', (object,), {})
+    def instances(cls):
+        return cls.instance_cache.items()
+
+
+def _dispose(self):
+    pass
+
+
+OnePerWindow = MetaOnePerWindow('OnePerWindow', (object,), {'dispose': _dispose})
+
+
+def evict_windows(window_ids):
+    for cls in MetaOnePerWindow.classes:
+        for window_id in window_ids:
+            for instance in maybe(cls.instance_cache.evict(window_id)):
+                try:
+                    instance.dispose()
+                except Exception:
+                    traceback.print_exc()
+
+
+def evict_closed_windows():
+    open_ids = set(w.id() for w in sublime.windows())
+    evict_windows(set(window_id
+                      for cls in MetaOnePerWindow.classes
+                      for window_id, _ in cls.instances()
+                      if window_id not in open_ids))
+
+
+def approximate_size(obj, stop=()):
+
+    # The sizes of an object and everything reachable from it through
+    # containers and instance attributes, each counted once. Modules,
+    # classes, functions and instances of the `stop` classes aren't followed.
+
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending:
+        o = pending.pop()
+        if id(o) in seen or isinstance(o, (type, types.ModuleType, types.FunctionType,
+                                           types.MethodType, types.BuiltinFunctionType)):
+            continue
+        if o is not obj and isinstance(o, stop):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o, 0)
+        if isinstance(o, dict):
+            pending.extend(o.keys())
+            pending.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            pending.extend(o)
+        elif hasattr(o, '__dict__'):
+            pending.append(o.__dict__)
+    return size